@@ -0,0 +1,346 @@
+import os
+import mmap
+import binascii
+import multiprocessing
+from paillier import *
+from boosted_paillier import *
+import two_server
+
+"""
+This code implements a sharded engine to sum large collections of ciphertexts.
+The source is split in shards, each worker process (a node) reduces its own shard
+and the partial results are combined in a binary tree, also on the worker processes.
+It works for paillier ciphertexts, level 1 and level 2 ciphers and two server ciphers,
+and is a local stand in for a deployment with one node per machine.
+"""
+
+def combine(c1, c2, pub):
+    """
+    Adds two ciphertexts of the same kind
+
+    :param c1: paillier ciphertext, level 1, level 2 or two server cipher (or None)
+    :param c2: cipher of the same kind as c1 (or None)
+    :param pub: public key object
+    :return: sum of the two ciphers
+    """
+    if c1 is None:
+        return c2
+    if c2 is None:
+        return c1
+    if isinstance(c1, two_server.CipherTwoServer):
+        if isinstance(c1.alpha, CipherLevel1):
+            return two_server.ts_add1(c1, c2, pub)
+        return two_server.ts_add2(c1, c2, pub)
+    if isinstance(c1, CipherLevel1):
+        return add1(c1, c2, pub)
+    if isinstance(c1, CipherLevel2):
+        return add2(c1, c2, pub)
+    return e_add(pub, c1, c2)
+
+def serialize(c):
+    """
+    Converts a cipher into a line of text
+
+    :param c: paillier ciphertext, level 1, level 2 or two server cipher
+    :return: string
+    """
+    if isinstance(c, two_server.CipherTwoServer):
+        if isinstance(c.alpha, CipherLevel1):
+            return "T1:%d;%d;%d" % (c.alpha.a, c.alpha.b, c.beta)
+        return "T2:%d;%d" % (c.alpha, c.beta)
+    if isinstance(c, CipherLevel1):
+        return "L1:%d;%d" % (c.a, c.b)
+    if isinstance(c, CipherLevel2):
+        return "L2:%d;" % c.a + ";".join("%d,%d" % (x[0], x[1]) for x in c.b)
+    return "P:%d" % c
+
+def deserialize(line):
+    """
+    Converts a line of text created by serialize back into a cipher
+
+    :param line: string
+    :return: cipher
+    """
+    kind, data = line.strip().split(":", 1)
+    aux = data.split(";")
+    if kind == "P":
+        return int(data)
+    if kind == "L1":
+        return CipherLevel1(int(aux[0]), int(aux[1]))
+    if kind == "L2":
+        return CipherLevel2(int(aux[0]), [[int(v) for v in x.split(",")] for x in aux[1:] if x])
+    if kind == "T1":
+        return two_server.CipherTwoServer(CipherLevel1(int(aux[0]), int(aux[1])), int(aux[2]))
+    if kind == "T2":
+        return two_server.CipherTwoServer(int(aux[0]), int(aux[1]))
+    raise Exception("unknown cipher kind: " + kind)
+
+def write_file(filename, ciphers):
+    """
+    Writes ciphers into a text file, one per line
+
+    :param filename: file to save
+    :param ciphers: iterable of ciphers
+    :return: returns nothing
+    """
+    out = open(filename, "w")
+    for c in ciphers:
+        out.write(serialize(c) + "\n")
+    out.close()
+
+def record_width(pub):
+    """
+    :param pub: public key object
+    :return: number of bytes of a number modulo n^2
+    """
+    return (pub.n_sq.bit_length() + 7) // 8
+
+def write_mmap(filename, ciphers, pub):
+    """
+    Writes paillier ciphertexts or level 1 ciphers as fixed size big endian
+    records, to be read with MmapSource
+
+    :param filename: file to save
+    :param ciphers: iterable of paillier ciphertexts or level 1 ciphers
+    :param pub: public key object
+    :return: returns nothing
+    """
+    width = record_width(pub)
+    out = open(filename, "wb")
+    for c in ciphers:
+        values = [c.a, c.b] if isinstance(c, CipherLevel1) else [c]
+        for v in values:
+            out.write(binascii.unhexlify("%0*x" % (2 * width, v)))
+    out.close()
+
+class ListShard():
+    """
+    Shard of an in memory list
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+class FileShard():
+    """
+    Shard of a text file created by write_file: the lines that start inside
+    the byte range [start, end)
+    """
+
+    def __init__(self, filename, start, end):
+        self.filename = filename
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        in_file = open(self.filename, "rb")
+        try:
+            in_file.seek(self.start)
+            if self.start > 0:
+                in_file.seek(self.start - 1)
+                in_file.readline() ## skip the line that started in the previous shard
+            while in_file.tell() < self.end:
+                line = in_file.readline()
+                if not line:
+                    break
+                if line.strip():
+                    yield deserialize(line)
+        finally:
+            in_file.close()
+
+class MmapShard():
+    """
+    Shard of a file created by write_mmap: records [first, last)
+    """
+
+    def __init__(self, filename, width, fields, first, last):
+        self.filename = filename
+        self.width = width
+        self.fields = fields
+        self.first = first
+        self.last = last
+
+    def __iter__(self):
+        in_file = open(self.filename, "rb")
+        data = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            size = self.width * self.fields
+            for i in xrange(self.first, self.last):
+                pos = i * size
+                values = [int(binascii.hexlify(data[pos + f * self.width:pos + (f + 1) * self.width]), 16)
+                          for f in xrange(self.fields)]
+                if self.fields == 1:
+                    yield values[0]
+                else:
+                    yield CipherLevel1(values[0], values[1])
+        finally:
+            data.close()
+            in_file.close()
+
+class FileSource():
+    """
+    Text file of ciphers created by write_file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def shards(self, k):
+        """
+        Splits the file in k byte ranges
+
+        :param k: number of shards
+        :return: list of FileShard objects
+        """
+        size = os.path.getsize(self.filename)
+        bounds = [size * i // k for i in xrange(k + 1)]
+        return [FileShard(self.filename, bounds[i], bounds[i + 1]) for i in xrange(k)]
+
+class MmapSource():
+    """
+    Memory mapped file of fixed size records created by write_mmap
+    """
+
+    def __init__(self, filename, pub, level1=False):
+        """
+        :param filename: file created by write_mmap
+        :param pub: public key object
+        :param level1: True if the records are level 1 ciphers, default False
+        """
+        self.filename = filename
+        self.width = record_width(pub)
+        self.fields = 2 if level1 else 1
+
+    def shards(self, k):
+        """
+        Splits the records in k ranges
+
+        :param k: number of shards
+        :return: list of MmapShard objects
+        """
+        count = os.path.getsize(self.filename) // (self.width * self.fields)
+        bounds = [count * i // k for i in xrange(k + 1)]
+        return [MmapShard(self.filename, self.width, self.fields, bounds[i], bounds[i + 1]) for i in xrange(k)]
+
+def list_shards(items, k):
+    """
+    Splits a list in k contiguous shards
+
+    :param items: list of ciphers
+    :param k: number of shards
+    :return: list of ListShard objects
+    """
+    bounds = [len(items) * i // k for i in xrange(k + 1)]
+    return [ListShard(items[bounds[i]:bounds[i + 1]]) for i in xrange(k)]
+
+def reduce_shard(args):
+    """
+    Node function: sums all the ciphers of a shard
+
+    :param args: tuple (shard, public key)
+    :return: sum of the shard, None if it is empty
+    """
+    shard, pub = args
+    total = None
+    for c in shard:
+        total = combine(total, c, pub)
+    return total
+
+def combine_pair(args):
+    """
+    Node function for the tree: sums two partial results
+
+    :param args: tuple (partial, partial, public key)
+    :return: sum of the two partials
+    """
+    c1, c2, pub = args
+    return combine(c1, c2, pub)
+
+def aggregate(source, pub, nodes=None, pool=None):
+    """
+    Sums all the ciphers of a source: every node reduces a shard and the
+    partial results are combined in a binary tree
+
+    :param source: list of ciphers, FileSource or MmapSource
+    :param pub: public key object
+    :param nodes: number of nodes (worker processes), default number of cpus
+    :param pool: multiprocessing pool to use, default a new pool of nodes processes
+    :return: sum of all the ciphers
+    """
+    if nodes is None:
+        nodes = multiprocessing.cpu_count()
+    if isinstance(source, list):
+        shards = list_shards(source, nodes)
+    else:
+        shards = source.shards(nodes)
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(nodes)
+    try:
+        partials = [p for p in pool.map(reduce_shard, [(s, pub) for s in shards], 1) if p is not None]
+        while len(partials) > 1:
+            pairs = [(partials[i], partials[i + 1], pub) for i in xrange(0, len(partials) - 1, 2)]
+            odd = partials[-1:] if len(partials) % 2 else []
+            partials = pool.map(combine_pair, pairs, 1) + odd
+        if own_pool:
+            pool.close()
+    finally:
+        if own_pool:
+            pool.terminate()
+    if not partials:
+        raise Exception("no ciphers to aggregate")
+    return partials[0]
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    print "\n****testing sharded aggregation:****"
+
+    priv, pub = generateKeys(256, save=False)
+    path = tempfile.mkdtemp()
+    values = [random.randrange(0, 1000) for _ in xrange(24)]
+
+    plain = [encrypt(pub, v) for v in values]
+    level1 = []
+    for v in values:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, v)
+        level1.append(c)
+
+    total = aggregate(plain, pub, nodes=3)
+    print "paillier sum: ", sum(values), " = ", decrypt(priv, pub, total)
+    assert decrypt(priv, pub, total) == sum(values)
+    assert aggregate(level1, pub, nodes=4).get_value(priv, pub) == sum(values)
+
+    level2 = [mult1(level1[i], level1[i + 1], pub) for i in xrange(0, 8, 2)]
+    expected = sum(values[i] * values[i + 1] for i in xrange(0, 8, 2))
+    assert aggregate(level2, pub, nodes=3).get_value(priv, pub) == expected
+
+    ts = []
+    for v in values:
+        c = two_server.CipherTwoServer(-1, -1)
+        c.create_level1_cipher(v, pub)
+        ts.append(c)
+    assert aggregate(ts, pub, nodes=2).get_value(priv, pub) == sum(values)
+    ts2 = [two_server.ts_mult(ts[i], ts[i + 1], pub) for i in xrange(0, 8, 2)]
+    assert aggregate(ts2, pub, nodes=2).get_value(priv, pub) == expected
+
+    text_name = os.path.join(path, "ciphers.txt")
+    write_file(text_name, level2 + level2)
+    assert aggregate(FileSource(text_name), pub, nodes=3).get_value(priv, pub) == 2 * expected
+    write_file(text_name, ts)
+    assert aggregate(FileSource(text_name), pub, nodes=5).get_value(priv, pub) == sum(values)
+
+    mmap_name = os.path.join(path, "ciphers.bin")
+    write_mmap(mmap_name, plain, pub)
+    total = aggregate(MmapSource(mmap_name, pub), pub, nodes=3)
+    print "memory mapped sum: ", sum(values), " = ", decrypt(priv, pub, total)
+    assert decrypt(priv, pub, total) == sum(values)
+    write_mmap(mmap_name, level1, pub)
+    assert aggregate(MmapSource(mmap_name, pub, level1=True), pub, nodes=4).get_value(priv, pub) == sum(values)
+    shutil.rmtree(path)
@@ -0,0 +1,72 @@
+import sys
+import time
+from paillier import *
+from boosted_paillier import *
+import two_server_third_degree as third
+
+"""
+Latency benchmark of the third degree multiplications: the interactive flow, where
+server 1 re-encrypts the b components and the key holder decrypts a level 2 cipher in
+the middle of every multiplication, against the current flow without round trips.
+Usage: python benchmark_third_degree.py [key size] [repetitions]
+"""
+
+def interactive_ts_mult1(c1, c2, priv, pub):
+    """
+    Previous ts_mult1: two prepare_message on server 1 and one decryption by the key holder
+    """
+    aux_a = mult1(c1.alpha, c2.alpha, pub)
+    b1 = CipherLevel1(1, 1)
+    b2 = CipherLevel1(1, 1)
+    b1.prepare_message(pub, c1.alpha.b)
+    b2.prepare_message(pub, c2.alpha.b)
+    aux_b = mult1(b1, b2, pub)
+    alpha = CipherLevel2(aux_a.a, aux_b.get_value(priv, pub)) ## round trip to the key holder
+    beta = third.server2_mult1(c1.beta, c2.beta, pub)
+    return third.CipherThirdDegree(alpha, beta)
+
+def interactive_ts_mult2(c1, c2, priv, pub):
+    """
+    Previous ts_mult2 (its result was not correct, only its cost is measured)
+    """
+    aux = e_mul_const(pub, c2.alpha.a, c1.alpha.a)
+    aux2 = e_mul_const(pub, c2.alpha.b, c1.alpha.a)
+    b1 = CipherLevel1(1, 1)
+    b2 = CipherLevel1(1, 1)
+    b1.prepare_message(pub, c1.alpha.b)
+    b2.prepare_message(pub, c2.alpha.b)
+    aux3 = mult1(b1, b2, pub)
+    alpha = e_add(pub, e_add(pub, aux, aux2), aux3.get_value(priv, pub)) ## round trip to the key holder
+    beta = third.server2_mult1(c1.beta, c2.beta, pub)
+    return third.CipherThirdDegree(alpha, beta)
+
+def measure(fn, args, repetitions):
+    """
+    :return: average seconds of fn(*args)
+    """
+    start = time.time()
+    for _ in xrange(repetitions):
+        fn(*args)
+    return (time.time() - start) / repetitions
+
+
+if __name__ == "__main__":
+    bits = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    priv, pub = generateKeys(bits, save=False)
+    c1 = third.CipherThirdDegree(-1, -1)
+    c2 = third.CipherThirdDegree(-1, -1)
+    c1.create_level1_cipher(11, pub)
+    c2.create_level1_cipher(5, pub)
+    old_level2 = interactive_ts_mult1(c1, c2, priv, pub)
+    level2 = third.ts_mult1(c1, c2, pub)
+
+    print "\n****third degree multiplication latency (", bits, "bits ):****"
+    print "operation  interactive (ms, 1 round trip)  current (ms, 0 round trips)"
+    old = measure(interactive_ts_mult1, (c1, c2, priv, pub), repetitions)
+    new = measure(third.ts_mult1, (c1, c2, pub), repetitions)
+    print "ts_mult1  ", round(old * 1000, 2), "  ", round(new * 1000, 2)
+    old = measure(interactive_ts_mult2, (c1, old_level2, priv, pub), repetitions)
+    new = measure(third.ts_mult2, (c1, level2, pub), repetitions)
+    print "ts_mult2  ", round(old * 1000, 2), "  ", round(new * 1000, 2)
@@ -203,52 +203,69 @@ def rerand2(c1, pub):
     raise("Method is not complete!")
     return 1
 
-key_size = 256
-priv, pub = generateKeys(key_size)
-
-m1 = 5
-m2 = 10
-const = 3
-
-print "****testing original paillier:***"
-x = encrypt(pub, m1)
-x1 = decrypt(priv, pub, x)
-assert x1 == m1 ##verify decrpytion    
-
-y = encrypt(pub, m2)
-z = e_add(pub, x, y)   
-print "two ciphers sum: ", m1, " + ", m2, " = ", decrypt(priv, pub, z)
-z = e_add_const(pub, x, const)
-print "add constant to cipher: ", m1, " + ", const, " = ", decrypt(priv, pub, z)
-z = e_mul_const(pub, x, const)
-print "multiply constant by cipher: ", m1, " . ", const, " = ", decrypt(priv, pub, z)
-
-
-print "\n****testing boosted paillier:****"
-
-c1 = CipherLevel1(-1,-1)
-c2 = CipherLevel1(-1,-1)
-c1.prepare_message(pub, m1)
-c2.prepare_message(pub, m2)
-
-add_c = add1(c1, c2, pub)
-print "two level 1 ciphers sum: ", m1, " + ", m2, " = ", add_c.get_value(priv, pub)
-assert (m1 + m2) == add_c.get_value(priv, pub) 
-mult_c = mult1(c1, c2, pub)
-print "two level 1 ciphers multiplication: ", m1, " * ", m2, " = ", mult_c.get_value(priv, pub)
-assert len(bin(m1 * m2)) < key_size -2, "Multiplication is outside of the keyspace, lower the values!"
-assert (m1 * m2) == mult_c.get_value(priv, pub) 
-const_mult = cmult1(const, c1, pub)
-print "level 1 cipher by constant multiplication: ", m1, " * ", const, " = ", const_mult.get_value(priv, pub)
-assert (const * m1) == const_mult.get_value(priv, pub)
-add2_c = add2(mult_c, mult_c, pub)
-val = mult_c.get_value(priv, pub)
-print "two level 2 ciphers sum: ", val, " + ", val, " = ", add2_c.get_value(priv,pub)
-assert (val + val) == add2_c.get_value(priv,pub) 
-mult2_c = cmult2(const, add2_c, pub)
-print "level 2 cipher by constant multiplication: ", const, " * ", add2_c.get_value(priv, pub), " = ", mult2_c.get_value(priv, pub) 
-assert (const * add2_c.get_value(priv, pub)) == mult2_c.get_value(priv, pub)
+if __name__ == "__main__":
+    key_size = 256
+    priv, pub = generateKeys(key_size)
 
+    m1 = 5
+    m2 = 10
+    const = 3
 
+    print "****testing original paillier:***"
+    x = encrypt(pub, m1)
+    x1 = decrypt(priv, pub, x)
+    assert x1 == m1 ##verify decrpytion
 
+    y = encrypt(pub, m2)
+    z = e_add(pub, x, y)
+    print "two ciphers sum: ", m1, " + ", m2, " = ", decrypt(priv, pub, z)
+    z = e_add_const(pub, x, const)
+    print "add constant to cipher: ", m1, " + ", const, " = ", decrypt(priv, pub, z)
+    z = e_mul_const(pub, x, const)
+    print "multiply constant by cipher: ", m1, " . ", const, " = ", decrypt(priv, pub, z)
+    z = e_mul_const(pub, x, -const)
+    print "multiply negative constant by cipher: ", m1, " . ", -const, " = ", decrypt(priv, pub, z) - pub.n
+    assert decrypt(priv, pub, z) == pub.n - m1 * const
 
+
+    print "\n****testing boosted paillier:****"
+
+    c1 = CipherLevel1(-1,-1)
+    c2 = CipherLevel1(-1,-1)
+    c1.prepare_message(pub, m1)
+    c2.prepare_message(pub, m2)
+
+    add_c = add1(c1, c2, pub)
+    print "two level 1 ciphers sum: ", m1, " + ", m2, " = ", add_c.get_value(priv, pub)
+    assert (m1 + m2) == add_c.get_value(priv, pub)
+    mult_c = mult1(c1, c2, pub)
+    print "two level 1 ciphers multiplication: ", m1, " * ", m2, " = ", mult_c.get_value(priv, pub)
+    assert len(bin(m1 * m2)) < key_size -2, "Multiplication is outside of the keyspace, lower the values!"
+    assert (m1 * m2) == mult_c.get_value(priv, pub)
+    const_mult = cmult1(const, c1, pub)
+    print "level 1 cipher by constant multiplication: ", m1, " * ", const, " = ", const_mult.get_value(priv, pub)
+    assert (const * m1) == const_mult.get_value(priv, pub)
+    add2_c = add2(mult_c, mult_c, pub)
+    val = mult_c.get_value(priv, pub)
+    print "two level 2 ciphers sum: ", val, " + ", val, " = ", add2_c.get_value(priv,pub)
+    assert (val + val) == add2_c.get_value(priv,pub)
+    mult2_c = cmult2(const, add2_c, pub)
+    print "level 2 cipher by constant multiplication: ", const, " * ", add2_c.get_value(priv, pub), " = ", mult2_c.get_value(priv, pub)
+    assert (const * add2_c.get_value(priv, pub)) == mult2_c.get_value(priv, pub)
+
+
+
+
+
+    print "\n****testing short exponent encryption:****"
+    for i in xrange(SHORT_EXP_TABLES_SIZE + 4):
+        pub.enableShortExponent(80)
+        assert decrypt(priv, pub, encrypt(pub, i)) == i
+    assert len(short_exp_tables) == SHORT_EXP_TABLES_SIZE ## only the last tables are kept
+    pub.enableShortExponent(112)
+    x = encrypt(pub, m1)
+    assert decrypt(priv, pub, x) == m1
+    c1.prepare_message(pub, m1)
+    rerand_c = rerand1(c1, pub)
+    print "level 1 cipher with short exponent: ", m1, " = ", rerand_c.get_value(priv, pub)
+    assert rerand_c.get_value(priv, pub) == m1
@@ -0,0 +1,453 @@
+import time
+import Queue
+import logging
+import threading
+import multiprocessing
+from paillier import *
+from boosted_paillier import *
+
+"""
+This code implements a non blocking facade to embed the library in an event driven
+service. Calls return immediately with a PendingResult; a dispatcher thread groups
+concurrent calls to the same function into batches (up to max_batch calls, waiting at
+most max_delay seconds for the batch to fill) and runs them on a process pool, so the
+caller thread never runs the modular exponentiations itself.
+A batch is split in one sub-batch per worker process, so a burst of calls still runs
+in parallel.
+Results can be waited for with a timeout, cancelled before they are dispatched, or
+delivered through callbacks (e.g. to loop.call_soon_threadsafe of an event loop).
+Exceptions raised by callbacks are logged and do not stop the service.
+"""
+
+log = logging.getLogger(__name__)
+
+PENDING = 0
+RUNNING = 1
+CANCELLED = 2
+FINISHED = 3
+
+class CancelledError(Exception):
+    """
+    Raised when the result of a cancelled call is requested
+    """
+    pass
+
+class PendingResult():
+    """
+    Result of a call submitted to a CryptoService
+    """
+
+    def __init__(self, deadline=None):
+        """
+        Constructs a PendingResult object
+
+        :param deadline: time after which the call is not dispatched anymore, default None
+        """
+        self.deadline = deadline
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def cancel(self):
+        """
+        Cancels the call if it was not dispatched yet
+
+        :return: True if the call was cancelled
+        """
+        with self._lock:
+            if self._state != PENDING:
+                return self._state == CANCELLED
+            self._state = CANCELLED
+        self._event.set()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        """
+        :return: True if the call was cancelled
+        """
+        return self._state == CANCELLED
+
+    def done(self):
+        """
+        :return: True if the call was cancelled or has a result
+        """
+        return self._state in (CANCELLED, FINISHED)
+
+    def get(self, timeout=None):
+        """
+        Waits for the result of the call
+
+        :param timeout: maximum seconds to wait, default None (wait forever)
+        :return: result of the call
+        """
+        if not self._event.wait(timeout):
+            raise multiprocessing.TimeoutError("result not ready after " + str(timeout) + " seconds")
+        if self._state == CANCELLED:
+            raise CancelledError("call was cancelled")
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(self) when the call is done. The callback runs in the service
+        threads, so it should only hand the result over (e.g. with
+        loop.call_soon_threadsafe)
+
+        :param fn: function that receives the PendingResult
+        :return: returns nothing
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _start(self):
+        """
+        Marks the call as dispatched
+
+        :return: False if the call was cancelled
+        """
+        with self._lock:
+            if self._state != PENDING:
+                return False
+            self._state = RUNNING
+            return True
+
+    def _set(self, result=None, exception=None):
+        """
+        Stores the result (or exception) of the call, without running the
+        callbacks (see _run_callbacks)
+        """
+        with self._lock:
+            if self.done():
+                return
+            self._result = result
+            self._exception = exception
+            self._state = FINISHED
+        self._event.set()
+
+    def _run_callbacks(self):
+        """
+        Runs the done callbacks, logging the exceptions they raise
+        """
+        with self._lock:
+            callbacks = self._callbacks
+            self._callbacks = []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                log.exception("done callback of a crypto service call failed")
+
+def finish(results, values=None, exception=None):
+    """
+    Sets every result of a batch and only then runs their callbacks, so a slow
+    or failing callback does not delay the other results
+
+    :param results: list of PendingResult objects
+    :param values: list of (True, result) or (False, error message), default None
+    :param exception: exception to set in all the results, default None
+    :return: returns nothing
+    """
+    for i, r in enumerate(results):
+        if values is None:
+            r._set(exception=exception)
+        elif values[i][0]:
+            r._set(result=values[i][1])
+        else:
+            r._set(exception=Exception(values[i][1]))
+    for r in results:
+        r._run_callbacks()
+
+def run_batch(fn, batch):
+    """
+    Worker function: runs fn for every argument tuple of a batch
+
+    :param fn: module level function
+    :param batch: list of argument tuples
+    :return: list of (True, result) or (False, error message)
+    """
+    results = []
+    for args in batch:
+        try:
+            results.append((True, fn(*args)))
+        except Exception as e:
+            results.append((False, "%s: %s" % (type(e).__name__, e)))
+    return results
+
+def get_value(c, priv, pub):
+    """
+    Decrypts any cipher that has a get_value method (level 1, level 2, two server)
+
+    :param c: cipher
+    :param priv: private key object
+    :param pub: public key object
+    :return: plain value
+    """
+    return c.get_value(priv, pub)
+
+def prepare_message(pub, m):
+    """
+    :param pub: public key object
+    :param m: value to encrypt
+    :return: level 1 cipher of m
+    """
+    c = CipherLevel1(-1, -1)
+    c.prepare_message(pub, m)
+    return c
+
+class CryptoService():
+    """
+    Process pool with micro-batching for encryption, decryption and the other
+    expensive functions of the library
+    """
+
+    def __init__(self, processes=None, max_batch=64, max_delay=0.005, pool=None):
+        """
+        Constructs a CryptoService object and starts its dispatcher thread
+
+        :param processes: number of worker processes, default number of cpus
+        :param max_batch: maximum number of calls sent to a worker at once, default 64
+        :param max_delay: maximum seconds a call waits for its batch to fill, default 0.005
+        :param pool: multiprocessing pool to use instead of creating one, default None
+        """
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._own_pool = pool is None
+        self.pool = multiprocessing.Pool(processes) if pool is None else pool
+        self.processes = getattr(self.pool, "_processes", None) or processes or multiprocessing.cpu_count()
+        self._queue = Queue.Queue()
+        self._watched = Queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._dispatch)
+        self._thread.daemon = True
+        self._thread.start()
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules fn(*args) on the process pool
+
+        :param fn: module level function (it is sent to the workers by name)
+        :param args: arguments of fn
+        :param timeout: optional keyword, seconds after which the call fails with
+                        TimeoutError if it was not dispatched
+        :return: PendingResult object
+        """
+        if self._closed:
+            raise Exception("service is closed")
+        timeout = kwargs.get("timeout")
+        deadline = None if timeout is None else time.time() + timeout
+        result = PendingResult(deadline)
+        self._queue.put((fn, args, result))
+        return result
+
+    def encrypt(self, pub, plain, timeout=None):
+        """
+        :return: PendingResult of encrypt(pub, plain)
+        """
+        return self.submit(encrypt, pub, plain, timeout=timeout)
+
+    def decrypt(self, priv, pub, cipher, timeout=None):
+        """
+        :return: PendingResult of decrypt(priv, pub, cipher)
+        """
+        return self.submit(decrypt, priv, pub, cipher, timeout=timeout)
+
+    def prepare_message(self, pub, m, timeout=None):
+        """
+        :return: PendingResult of a level 1 cipher of m
+        """
+        return self.submit(prepare_message, pub, m, timeout=timeout)
+
+    def get_value(self, c, priv, pub, timeout=None):
+        """
+        :return: PendingResult of c.get_value(priv, pub)
+        """
+        return self.submit(get_value, c, priv, pub, timeout=timeout)
+
+    def _dispatch(self):
+        """
+        Dispatcher thread: collects calls into batches and sends them to the pool
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            end = time.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = end - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except Queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            groups = {}
+            for fn, args, result in batch:
+                groups.setdefault(fn, []).append((args, result))
+            for fn, calls in groups.items():
+                self._send(fn, calls)
+            if stop:
+                return
+
+    def _send(self, fn, calls):
+        """
+        Sends the calls to fn that are still pending to the pool, split in one
+        sub-batch per worker process
+        """
+        now = time.time()
+        ready = []
+        expired = []
+        for args, result in calls:
+            if result.deadline is not None and now > result.deadline:
+                expired.append(result)
+            elif result._start():
+                ready.append((args, result))
+        finish(expired, exception=multiprocessing.TimeoutError("deadline expired before dispatch"))
+        size = max(1, -(-len(ready) // self.processes))
+        for i in xrange(0, len(ready), size):
+            self._apply(fn, ready[i:i + size])
+
+    def _apply(self, fn, ready):
+        """
+        Sends one sub-batch to the pool
+        """
+        results = [r for _, r in ready]
+        def callback(values):
+            finish(results, values)
+        def error_callback(e):
+            finish(results, exception=e)
+        try:
+            async_result = self.pool.apply_async(run_batch, (fn, [args for args, _ in ready]), callback=callback)
+        except Exception as e:
+            error_callback(e)
+            return
+        self._watched.put((async_result, error_callback))
+
+    def _watch(self):
+        """
+        Watcher thread: reports failures of the batches that did not go through
+        the callback (e.g. unpicklable arguments or results)
+        """
+        while True:
+            item = self._watched.get()
+            if item is None:
+                return
+            async_result, error_callback = item
+            try:
+                async_result.get()
+            except Exception as e:
+                error_callback(e)
+
+    def close(self):
+        """
+        Dispatches the calls already submitted and stops the service
+        :return: returns nothing
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._watched.put(None)
+        self._watcher.join()
+        if self._own_pool:
+            self.pool.close()
+            self.pool.join()
+
+
+if __name__ == "__main__":
+    import two_server
+
+    print "\n****testing crypto service:****"
+
+    priv, pub = generateKeys(256, save=False)
+    service = CryptoService(processes=2, max_batch=8)
+
+    start = time.time()
+    pending = [service.encrypt(pub, m) for m in xrange(20)]
+    print "submit time (ms): ", (time.time() - start) * 1000
+    ciphers = [p.get(timeout=60) for p in pending]
+    plains = [service.decrypt(priv, pub, c) for c in ciphers]
+    assert [p.get(timeout=60) for p in plains] == range(20)
+
+    c1 = service.prepare_message(pub, 6).get(timeout=60)
+    c2 = service.prepare_message(pub, 7).get(timeout=60)
+    assert service.get_value(mult1(c1, c2, pub), priv, pub).get(timeout=60) == 42
+
+    t1 = two_server.CipherTwoServer(-1, -1)
+    t2 = two_server.CipherTwoServer(-1, -1)
+    t1.create_level1_cipher(3, pub)
+    t2.create_level1_cipher(4, pub)
+    mult_c = service.submit(two_server.ts_mult, t1, t2, pub).get(timeout=60)
+    print "two server multiplication: 3 * 4 = ", service.get_value(mult_c, priv, pub).get(timeout=60)
+
+    done = []
+    p = service.encrypt(pub, 1)
+    p.add_done_callback(lambda r: done.append(r))
+    p.get(timeout=60)
+    time.sleep(0.01)
+    assert done == [p]
+
+    logged = []
+    handler = logging.Handler()
+    handler.emit = logged.append
+    log.addHandler(handler)
+    def failing(r):
+        raise Exception("callback error")
+    pending = [service.encrypt(pub, m) for m in xrange(4)]
+    for p in pending:
+        p.add_done_callback(failing)
+    assert [decrypt(priv, pub, p.get(timeout=60)) for p in pending] == range(4)
+    time.sleep(0.01)
+    print "failing callbacks logged: ", len(logged)
+    assert len(logged) == 4
+    assert decrypt(priv, pub, service.encrypt(pub, 5).get(timeout=60)) == 5 ## service still works
+
+    sizes = []
+    apply = service._apply
+    service._apply = lambda fn, ready: sizes.append(len(ready)) or apply(fn, ready)
+    pending = [service.encrypt(pub, m) for m in xrange(8)]
+    assert [decrypt(priv, pub, p.get(timeout=60)) for p in pending] == range(8)
+    print "sub-batches of a burst of 8 calls on 2 processes: ", sizes
+    assert sizes == [4, 4] ## one sub-batch per worker
+    service._apply = apply
+
+    expired = service.encrypt(pub, 1, timeout=-1)
+    try:
+        expired.get(timeout=60)
+        assert False
+    except multiprocessing.TimeoutError:
+        pass
+    error = service.decrypt(priv, pub, "not a cipher")
+    try:
+        error.get(timeout=60)
+        assert False
+    except Exception as e:
+        print "error is reported: ", e
+    service.close()
+
+    slow = CryptoService(processes=1, max_delay=0.5)
+    p = slow.encrypt(pub, 1)
+    assert p.cancel() and p.cancelled()
+    try:
+        p.get(timeout=1)
+        assert False
+    except CancelledError:
+        pass
+    slow.close()
@@ -0,0 +1,210 @@
+import multiprocessing
+from paillier import *
+from boosted_paillier import *
+from pipeline import decode
+
+"""
+This code implements plaintext matrix times encrypted vector (Wx) and quadratic
+forms (x^T Q x) over vectors of level 1 ciphers.
+Every output is a multi-exponentiation of the b values of x. The window tables of
+each b are built once and reused by every row, and the rows are spread across
+worker processes. For the quadratic form only the upper triangle of Q is used:
+    x^T Q x = a^T Q a + sum_j r_j ((Q + Q^T) a)_j + sum_j r_j sum_{k >= j} Q'_jk r_k
+with Q'_jj = Q_jj and Q'_jk = Q_jk + Q_kj, which gives a level 2 cipher with one
+pair per coordinate.
+"""
+
+WINDOW = 4
+
+def straus_tables(bases, modulus, window=WINDOW):
+    """
+    Builds the window tables of a list of bases, base^t for t < 2^window
+
+    :param bases: list of base numbers
+    :param modulus: modulos number
+    :param window: window size in bits, default 4
+    :return: list of tables
+    """
+    tables = []
+    for b in bases:
+        t = [1, b % modulus]
+        for _ in xrange(2, 1 << window):
+            t.append((t[-1] * b) % modulus)
+        tables.append(t)
+    return tables
+
+def straus_exp(tables, exponents, modulus, window=WINDOW):
+    """
+    Multi-exponentiation with precomputed window tables (Straus' algorithm):
+    all the bases share the same chain of squarings
+
+    :param tables: window tables of the bases (see straus_tables)
+    :param exponents: list of exponents, one per table
+    :param modulus: modulos number
+    :param window: window size used to build the tables, default 4
+    :return: (prod base_i^exponent_i) % modulus
+    """
+    terms = [(t, e) for t, e in zip(tables, exponents) if e > 0]
+    if not terms:
+        return 1
+    bits = max(e.bit_length() for _, e in terms)
+    mask = (1 << window) - 1
+    result = 1
+    for shift in xrange(((bits - 1) // window) * window, -1, -window):
+        if result != 1:
+            for _ in xrange(window):
+                result = (result * result) % modulus
+        for t, e in terms:
+            digit = (e >> shift) & mask
+            if digit:
+                result = (result * t[digit]) % modulus
+    return result
+
+_tables = None
+_modulus = None
+
+def _init_worker(bases, modulus):
+    """
+    Builds the tables of the b values once per worker process
+    """
+    global _tables, _modulus
+    _tables = straus_tables(bases, modulus)
+    _modulus = modulus
+
+def _row_exp(args):
+    """
+    Worker function: multi-exponentiation of the bases starting at offset.
+    Negative exponents are raised separately and the product is inverted,
+    so a weight -k costs as much as k instead of n - k.
+
+    :param args: tuple (offset, list of signed exponents)
+    :return: product of the bases raised to the exponents
+    """
+    offset, exps = args
+    tables = _tables[offset:offset + len(exps)]
+    result = straus_exp(tables, exps, _modulus)
+    if any(e < 0 for e in exps):
+        neg = straus_exp(tables, [-e for e in exps], _modulus)
+        result = (result * modinv(neg, _modulus)) % _modulus
+    return result
+
+def signed(v, n):
+    """
+    :param v: constant
+    :param n: modulus
+    :return: representative of v modulo n in (-n/2, n/2]
+    """
+    v %= n
+    if v > n // 2:
+        v -= n
+    return v
+
+def _map_rows(bases, rows, pub, processes):
+    """
+    Computes the multi-exponentiation of each row, in worker processes if
+    processes is larger than 1
+
+    :param bases: list of b values
+    :param rows: list of tuples (offset, list of exponents)
+    :param pub: public key object
+    :param processes: number of worker processes, default number of cpus
+    :return: list of results, one per row
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if processes <= 1 or len(rows) <= 1:
+        _init_worker(bases, pub.n_sq)
+        return map(_row_exp, rows)
+    pool = multiprocessing.Pool(processes, _init_worker, (bases, pub.n_sq))
+    try:
+        results = pool.map(_row_exp, rows, max(1, len(rows) // (4 * processes)))
+        pool.close()
+    finally:
+        pool.terminate()
+    return results
+
+def matrix_vector(W, x, pub, processes=None):
+    """
+    Multiplies a plaintext matrix by a vector of level 1 ciphers
+
+    :param W: list of rows of constants
+    :param x: list of level 1 ciphers
+    :param pub: public key object
+    :param processes: number of worker processes, default number of cpus
+    :return: list of level 1 ciphers, one per row of W
+    """
+    n = pub.n
+    rows = []
+    for w in W:
+        if len(w) != len(x):
+            raise Exception("matrix and vector sizes do not match")
+        rows.append((0, [signed(c, n) for c in w]))
+    bs = _map_rows([c.b for c in x], rows, pub, processes)
+    result = []
+    for (_, w), b in zip(rows, bs):
+        a = sum(c * xi.a for c, xi in zip(w, x)) % n
+        result.append(CipherLevel1(a, b))
+    return result
+
+def quadratic_form(Q, x, pub, processes=None):
+    """
+    Computes x^T Q x for a plaintext matrix Q and a vector of level 1 ciphers
+
+    :param Q: square matrix of constants, as a list of rows
+    :param x: list of level 1 ciphers
+    :param pub: public key object
+    :param processes: number of worker processes, default number of cpus
+    :return: level 2 cipher with one pair per coordinate of x
+    """
+    n = pub.n
+    d = len(x)
+    if len(Q) != d or any(len(q) != d for q in Q):
+        raise Exception("matrix and vector sizes do not match")
+    a = [c.a for c in x]
+    upper = []
+    for j in xrange(d):
+        upper.append([signed(Q[j][j], n)] + [signed(Q[j][k] + Q[k][j], n) for k in xrange(j + 1, d)])
+    plain = 0
+    linear = [0] * d ## (Q + Q^T) a, computed from the upper triangle
+    for j in xrange(d):
+        row = upper[j]
+        plain += a[j] * sum(q * a[j + i] for i, q in enumerate(row))
+        linear[j] += 2 * row[0] * a[j]
+        for i in xrange(1, len(row)):
+            linear[j] += row[i] * a[j + i]
+            linear[j + i] += row[i] * a[j]
+    rows = [(0, [signed(v, n) for v in linear])] + [(j, upper[j]) for j in xrange(d)]
+    res = _map_rows([c.b for c in x], rows, pub, processes)
+    alpha = e_add_const(pub, res[0], plain)
+    return CipherLevel2(alpha, [[x[j].b, res[j + 1]] for j in xrange(d)])
+
+
+if __name__ == "__main__":
+    import time
+
+    print "\n****testing encrypted matrix operations:****"
+
+    priv, pub = generateKeys(256, save=False)
+    d = 12
+    values = [random.randrange(-20, 20) for _ in xrange(d)]
+    x = []
+    for v in values:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, v % pub.n)
+        x.append(c)
+
+    W = [[random.randrange(-5, 6) for _ in xrange(d)] for _ in xrange(4)]
+    y = matrix_vector(W, x, pub, processes=2)
+    expected = [sum(w * v for w, v in zip(row, values)) for row in W]
+    print "Wx: ", [decode(c.get_value(priv, pub), pub) for c in y], " = ", expected
+    assert [decode(c.get_value(priv, pub), pub) for c in y] == expected
+
+    Q = [[random.randrange(-9, 10) for _ in xrange(d)] for _ in xrange(d)]
+    start = time.time()
+    z = quadratic_form(Q, x, pub, processes=2)
+    elapsed = time.time() - start
+    expected = sum(Q[j][k] * values[j] * values[k] for j in xrange(d) for k in xrange(d))
+    print "x^T Q x: ", expected, " = ", decode(z.get_value(priv, pub), pub), " (", round(elapsed, 3), "s)"
+    assert z.get_value(priv, pub) == expected % pub.n
+    assert len(z.b) == d
+    assert quadratic_form(Q, x, pub, processes=1).get_value(priv, pub) == expected % pub.n
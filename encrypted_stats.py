@@ -0,0 +1,247 @@
+from fractions import Fraction
+from paillier import *
+from boosted_paillier import *
+from pipeline import decode
+
+"""
+This code implements fused kernels to compute statistics over encrypted columns.
+A single pass over rows of level 1 ciphers computes the sums of every column and the
+sums of products of every pair of columns (sum of squares, sum of xy, Gram matrix).
+For a pair of columns j, k:
+    sum x_j x_k = sum a_j a_k + sum (a_j r_k + a_k r_j) + sum r_j r_k
+the first term is accumulated in plain, the second with one double exponentiation per
+row and the third is left to the decryption, which decrypts each b of the columns once
+and shares it between all the statistics instead of keeping a list of pairs per statistic.
+"""
+
+class EncryptedMoments():
+    """
+    Result of the moments kernel: level 1 sums of each column and, for each
+    pair of columns, the a part of the level 2 sum of products. The b parts of
+    the columns are shared by all the statistics.
+    """
+
+    def __init__(self, count, sums, products, b_columns):
+        """
+        Constructs an EncryptedMoments object
+
+        :param count: number of rows
+        :param sums: list of level 1 ciphers, sum of each column
+        :param products: dictionary (j, k) -> cipher of sum a_j a_k + a_j r_k + a_k r_j
+        :param b_columns: list with the b values of each column
+        """
+        self.count = count
+        self.sums = sums
+        self.products = products
+        self.b_columns = b_columns
+
+    def level2(self, j, k):
+        """
+        Returns the sum of products of columns j and k as a regular level 2 cipher
+
+        :param j: column index
+        :param k: column index
+        :return: level 2 cipher
+        """
+        if j > k:
+            j, k = k, j
+        pairs = [[x, y] for x, y in zip(self.b_columns[j], self.b_columns[k])]
+        return CipherLevel2(self.products[(j, k)], pairs)
+
+    def decrypt(self, priv, pub):
+        """
+        Decrypts all the statistics. Each b value is decrypted only once.
+
+        :param priv: private key object
+        :param pub: public key object
+        :return: Moments object with signed values
+        """
+        r = [[decrypt(priv, pub, b) for b in column] for column in self.b_columns]
+        sums = [decode((c.a + sum(r[j])) % pub.n, pub) for j, c in enumerate(self.sums)]
+        products = {}
+        for (j, k), c in self.products.items():
+            rr = sum(x * y for x, y in zip(r[j], r[k]))
+            products[(j, k)] = decode((decrypt(priv, pub, c) + rr) % pub.n, pub)
+        return Moments(self.count, sums, products)
+
+class Moments():
+    """
+    Decrypted moments: number of rows, sum of each column and sum of products
+    of pairs of columns
+    """
+
+    def __init__(self, count, sums, products):
+        """
+        Constructs a Moments object
+        """
+        self.count = count
+        self.sums = sums
+        self.products = products
+
+    def product(self, j, k):
+        """
+        :return: sum of x_j * x_k
+        """
+        if j > k:
+            j, k = k, j
+        return self.products[(j, k)]
+
+def moments(rows, pub, pairs=None):
+    """
+    Computes the sums and sums of products of encrypted columns in one pass
+
+    :param rows: iterable of rows, each one a list of level 1 ciphers (one per column)
+    :param pub: public key object
+    :param pairs: list of column pairs (j, k) to compute, default all pairs with j <= k
+    :return: EncryptedMoments object
+    """
+    n = pub.n
+    count = 0
+    d = None
+    for row in rows:
+        if d is None:
+            d = len(row)
+            if pairs is None:
+                pairs = [(j, k) for j in xrange(d) for k in xrange(j, d)]
+            pairs = [(min(j, k), max(j, k)) for j, k in pairs]
+            sum_a = [0] * d
+            sum_b = [1] * d
+            b_columns = [[] for _ in xrange(d)]
+            plain = dict((p, 0) for p in pairs)
+            cross = dict((p, 1) for p in pairs)
+        for j, c in enumerate(row):
+            sum_a[j] += c.a
+            sum_b[j] = e_add(pub, sum_b[j], c.b)
+            b_columns[j].append(c.b)
+        for j, k in pairs:
+            cj = row[j]
+            ck = row[k]
+            plain[(j, k)] += cj.a * ck.a
+            if j == k:
+                x = myExp(cj.b, (2 * cj.a) % n, pub.n_sq)
+            else:
+                x = multiExp([cj.b, ck.b], [ck.a, cj.a], pub.n_sq)
+            cross[(j, k)] = e_add(pub, cross[(j, k)], x)
+        count += 1
+    if d is None:
+        raise Exception("no rows to compute statistics")
+    sums = [CipherLevel1(a % n, b) for a, b in zip(sum_a, sum_b)]
+    products = dict((p, e_add_const(pub, cross[p], plain[p] % n)) for p in pairs)
+    return EncryptedMoments(count, sums, products, b_columns)
+
+def column_moments(column, pub):
+    """
+    Sum and sum of squares of a single encrypted column
+
+    :param column: list of level 1 ciphers
+    :param pub: public key object
+    :return: EncryptedMoments object with one column
+    """
+    return moments(([c] for c in column), pub)
+
+def regression_moments(features, target, pub):
+    """
+    Moments needed for a least squares fit: the Gram matrix of the features and
+    the target, the target being the last column
+
+    :param features: list of columns, each one a list of level 1 ciphers
+    :param target: list of level 1 ciphers
+    :param pub: public key object
+    :return: EncryptedMoments object
+    """
+    return moments((list(row) for row in zip(*(features + [target]))), pub)
+
+def mean(m, j=0):
+    """
+    :param m: Moments object
+    :param j: column index
+    :return: mean of column j
+    """
+    return float(m.sums[j]) / m.count
+
+def variance(m, j=0):
+    """
+    :param m: Moments object
+    :param j: column index
+    :return: population variance of column j
+    """
+    return covariance(m, j, j)
+
+def covariance(m, j, k):
+    """
+    :param m: Moments object
+    :param j: column index
+    :param k: column index
+    :return: population covariance of columns j and k
+    """
+    return float(Fraction(m.product(j, k), m.count) - Fraction(m.sums[j] * m.sums[k], m.count * m.count))
+
+def least_squares(m, features, target):
+    """
+    Solves the normal equations of a linear fit with intercept
+
+    :param m: Moments object
+    :param features: list of feature column indexes
+    :param target: target column index
+    :return: list of coefficients, intercept first
+    """
+    idx = [None] + list(features)
+    def prod(j, k):
+        if j is None and k is None:
+            return m.count
+        if j is None or k is None:
+            return m.sums[k if j is None else j]
+        return m.product(j, k)
+    size = len(idx)
+    mat = [[Fraction(prod(j, k)) for k in idx] + [Fraction(prod(j, target))] for j in idx]
+    for col in xrange(size): ##gaussian elimination
+        pivot = next((i for i in xrange(col, size) if mat[i][col] != 0), None)
+        if pivot is None:
+            raise Exception("normal equations are singular")
+        mat[col], mat[pivot] = mat[pivot], mat[col]
+        for i in xrange(size):
+            if i != col and mat[i][col] != 0:
+                f = mat[i][col] / mat[col][col]
+                mat[i] = [x - f * y for x, y in zip(mat[i], mat[col])]
+    return [float(mat[i][size] / mat[i][i]) for i in xrange(size)]
+
+
+if __name__ == "__main__":
+    print "\n****testing encrypted statistics:****"
+
+    priv, pub = generateKeys(256, save=False)
+
+    def enc_column(values):
+        column = []
+        for v in values:
+            c = CipherLevel1(-1, -1)
+            c.prepare_message(pub, v % pub.n)
+            column.append(c)
+        return column
+
+    xs = [random.randrange(-50, 50) for _ in xrange(20)]
+    ys = [3 * x - 7 + random.randrange(-2, 3) for x in xs]
+    ex = enc_column(xs)
+    ey = enc_column(ys)
+
+    m = column_moments(ex, pub).decrypt(priv, pub)
+    print "sum: ", sum(xs), " = ", m.sums[0]
+    print "sum of squares: ", sum(x * x for x in xs), " = ", m.product(0, 0)
+    assert m.sums[0] == sum(xs)
+    assert m.product(0, 0) == sum(x * x for x in xs)
+
+    em = regression_moments([ex], ey, pub)
+    m = em.decrypt(priv, pub)
+    assert m.product(0, 1) == sum(x * y for x, y in zip(xs, ys))
+    assert m.product(1, 1) == sum(y * y for y in ys)
+    assert em.level2(1, 0).get_value(priv, pub) == sum(x * y for x, y in zip(xs, ys)) % pub.n
+    mx = float(sum(xs)) / len(xs)
+    my = float(sum(ys)) / len(ys)
+    cov = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / len(xs)
+    print "mean: ", mx, " = ", mean(m, 0)
+    print "covariance: ", cov, " = ", covariance(m, 0, 1)
+    assert abs(covariance(m, 0, 1) - cov) < 1e-6
+    assert abs(variance(m, 0) - sum((x - mx) ** 2 for x in xs) / len(xs)) < 1e-6
+    beta = least_squares(m, [0], 1)
+    print "least squares y = b0 + b1 x: ", beta
+    assert abs(beta[1] - 3) < 0.5
@@ -0,0 +1,185 @@
+import sys
+from collections import OrderedDict
+import paillier
+from paillier import *
+
+"""
+This code implements a cache of fixed base exponentiation tables, one per
+(key, ciphertext). A ciphertext that is raised to many constants (cmult2 over the
+pairs of a level 2 cipher, mult1, matrix columns) gets a window table once it has
+been used more than a threshold number of times, after which every exponentiation
+costs one multiplication per window instead of a full myExp.
+Tables are kept in LRU order and evicted when the cache goes over its byte budget.
+The size of a table is known before building it, so bases whose table would not fit
+in the budget are never tabulated.
+"""
+
+DEFAULT_BUDGET = 32 * 1024 * 1024
+DEFAULT_THRESHOLD = 4
+MAX_TRACKED = 65536
+
+class ExpCache():
+    """
+    LRU cache of window tables indexed by (n^2, base)
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, threshold=DEFAULT_THRESHOLD, window=4):
+        """
+        Constructs an ExpCache object
+
+        :param budget: maximum memory used by the tables, in bytes, default 32MB
+        :param threshold: number of uses of a base before a table is built, default 4
+        :param window: window size of the tables in bits, default 4
+        """
+        self.budget = budget
+        self.threshold = threshold
+        self.window = window
+        self.tables = OrderedDict()
+        self.uses = OrderedDict()
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.evictions = 0
+        self.oversized = 0
+
+    def table_size(self, bits, modulus):
+        """
+        Estimates the memory used by a table, before building it
+
+        :param bits: maximum number of bits of the exponents
+        :param modulus: modulus of the table
+        :return: size in bytes
+        """
+        rows = (bits + self.window - 1) // self.window
+        row = [None] * (1 << self.window)
+        return rows * len(row) * (sys.getsizeof(modulus) + 8) + rows * sys.getsizeof(row)
+
+    def power(self, pub, base, exponent):
+        """
+        Calculates (base ^ exponent) % n^2, using or building the table of base
+
+        :param pub: public key object
+        :param base: ciphertext
+        :param exponent: exponent, smaller than n
+        :return: (base^exponent) % n^2
+        """
+        key = (pub.n_sq, base)
+        bits = pub.n.bit_length()
+        entry = self.tables.pop(key, None)
+        if entry is not None:
+            self.tables[key] = entry
+            self.hits += 1
+            if exponent.bit_length() > bits:
+                return myExp(base, exponent, pub.n_sq)
+            return windowExp(entry[0], exponent, pub.n_sq, self.window)
+        self.misses += 1
+        count = self.uses.pop(key, 0) + 1
+        if count <= self.threshold or exponent.bit_length() > bits:
+            self.uses[key] = count
+            if len(self.uses) > MAX_TRACKED:
+                self.uses.popitem(last=False)
+            return myExp(base, exponent, pub.n_sq)
+        size = self.table_size(bits, pub.n_sq)
+        if size > self.budget:
+            self.oversized += 1 ## the table would be evicted right away
+            return myExp(base, exponent, pub.n_sq)
+        table = windowTable(base, bits, pub.n_sq, self.window)
+        self.tables[key] = (table, size)
+        self.memory += size
+        self.builds += 1
+        while self.memory > self.budget:
+            _, (_, old_size) = self.tables.popitem(last=False)
+            self.memory -= old_size
+            self.evictions += 1
+        return windowExp(table, exponent, pub.n_sq, self.window)
+
+    def hit_rate(self):
+        """
+        :return: fraction of calls served from a table
+        """
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return float(self.hits) / total
+
+    def stats(self):
+        """
+        :return: dictionary with hits, misses, hit rate, tables, builds, evictions,
+                 oversized (calls whose table would not fit in the budget) and memory
+        """
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(),
+                "tables": len(self.tables), "builds": self.builds, "evictions": self.evictions,
+                "oversized": self.oversized, "memory": self.memory}
+
+    def clear(self):
+        """
+        Removes all the tables and usage counts
+        :return: returns nothing
+        """
+        self.tables.clear()
+        self.uses.clear()
+        self.memory = 0
+
+def install(cache):
+    """
+    Makes e_mul_const (and so cmult1, cmult2 and mult1) use a cache.
+    install(None) goes back to plain myExp.
+
+    :param cache: ExpCache object or None
+    :return: the cache that was installed before
+    """
+    old = paillier.mul_const_cache
+    paillier.mul_const_cache = cache
+    return old
+
+
+if __name__ == "__main__":
+    import time
+    from boosted_paillier import *
+
+    print "\n****testing exponentiation cache:****"
+
+    priv, pub = generateKeys(256, save=False)
+    m1 = 7
+    x = encrypt(pub, m1)
+    consts = [random.randrange(1, pub.n) for _ in xrange(200)]
+
+    start = time.time()
+    plain = [e_mul_const(pub, x, k) for k in consts]
+    plain_time = time.time() - start
+
+    cache = ExpCache(threshold=2)
+    install(cache)
+    start = time.time()
+    cached = [e_mul_const(pub, x, k) for k in consts]
+    cached_time = time.time() - start
+    assert cached == plain
+    assert decrypt(priv, pub, cached[-1]) == (m1 * consts[-1]) % pub.n
+    big = random.randrange(1, pub.n)
+    assert decrypt(priv, pub, e_mul_const(pub, x, big)) == (m1 * big) % pub.n
+    print "uncached: ", round(plain_time, 4), "s cached: ", round(cached_time, 4), "s", cache.stats()
+    assert cache.builds == 2 and cache.hit_rate() > 0.9 ## tables of x and of its inverse
+
+    c1 = CipherLevel1(-1, -1)
+    c2 = CipherLevel1(-1, -1)
+    c1.prepare_message(pub, 5)
+    c2.prepare_message(pub, 10)
+    mult_c = mult1(c1, c2, pub)
+    for k in xrange(5):
+        mult_c = add2(mult_c, mult1(c1, c2, pub), pub)
+    assert cmult2(3, mult_c, pub).get_value(priv, pub) == 3 * 6 * 50
+
+    small = ExpCache(budget=2 * (cache.memory // len(cache.tables)), threshold=0)
+    install(small)
+    for i in xrange(5):
+        assert decrypt(priv, pub, e_mul_const(pub, encrypt(pub, i), 3)) == 3 * i
+    print "small budget: ", small.stats()
+    assert small.evictions >= 3 and small.memory <= small.budget
+
+    tiny = ExpCache(budget=1000, threshold=1)
+    install(tiny)
+    assert [e_mul_const(pub, x, k) for k in consts[:40]] == plain[:40]
+    print "budget smaller than a table: ", tiny.stats()
+    assert tiny.builds == 0 and tiny.oversized > 0 and tiny.memory == 0
+    install(None)
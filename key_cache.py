@@ -0,0 +1,264 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+import paillier
+from paillier import *
+from keystore import KeyContext, KeyStore, key_id, pool_subset
+
+"""
+This code implements a process wide registry of key contexts for services that hold
+many tenant keys. Contexts (n^2, CRT constants, randomizer pools, fixed base tables)
+are indexed by key id, built lazily on first use (once, even if several threads ask for
+the same key at the same time), kept in LRU order and evicted when the registry goes
+over its byte budget. Forked workers inherit the warm contexts; the locks are recreated
+and the random generator is reseeded after a fork.
+The cache owns the fixed base tables of h of the short exponent keys it holds: they are
+built when the context is added, counted in the budget and dropped on eviction. Tables
+that paillier.encrypt builds for keys that are not in the cache are not counted.
+"""
+
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+class KeyContextCache():
+    """
+    LRU registry of KeyContext objects indexed by key id
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, pool_size=0):
+        """
+        Constructs a KeyContextCache object
+
+        :param budget: maximum memory used by the contexts, in bytes, default 256MB
+        :param pool_size: randomizers precomputed for each new context, default 0.
+                          It must be 0 or large enough for pool_subset; keys in short
+                          exponent mode never get a pool
+        """
+        if pool_size and pool_subset(pool_size) is None:
+            raise Exception("a pool of %d randomizers is too small to be used" % pool_size)
+        self.budget = budget
+        self.pool_size = pool_size
+        self.entries = OrderedDict()
+        self.ids = {}
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.evictions = 0
+        self._reset_locks()
+
+    def _reset_locks(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.building = {}
+
+    def _check_fork(self):
+        """
+        Recreates the locks and reseeds random in a forked process, so workers do
+        not inherit a held lock or draw the same randomness as their parent
+        """
+        if os.getpid() != self.pid:
+            self._reset_locks()
+            random.seed()
+
+    def key_id(self, pub):
+        """
+        :param pub: public key object
+        :return: key id of pub, memoized by modulus
+        """
+        kid = self.ids.get(pub.n)
+        if kid is None:
+            kid = key_id(pub)
+            self.ids[pub.n] = kid
+        return kid
+
+    def get(self, pub, priv=None):
+        """
+        Returns the context of a key, building it on first use.
+        If priv is given and the cached context has no private key it is added.
+
+        :param pub: public key object
+        :param priv: private key object, default None
+        :return: KeyContext object
+        """
+        self._check_fork()
+        kid = self.key_id(pub)
+        while True:
+            with self.lock:
+                entry = self.entries.pop(kid, None)
+                if entry is not None:
+                    self.entries[kid] = entry
+                    self.hits += 1
+                    ctx, _, table = entry
+                    if table is not None and (ctx.pub.n_sq, ctx.pub.h) not in short_exp_tables:
+                        putShortExpTable(ctx.pub, table) ## put back if it was evicted
+                    if priv is None or ctx.crt is not None:
+                        return ctx
+                event = self.building.get(kid)
+                if event is None:
+                    event = threading.Event()
+                    self.building[kid] = event
+                    break
+            event.wait() ## another thread is building this context
+        try:
+            if entry is not None:
+                ctx = entry[0]
+                ctx.priv = priv
+                ctx.crt = ctx.compute_crt()
+            else:
+                ctx = KeyContext(pub, priv, 0 if pub.h is not None else self.pool_size)
+            self.put(ctx, kid, count_miss=entry is None)
+        finally:
+            with self.lock:
+                del self.building[kid]
+            event.set()
+        return ctx
+
+    def put(self, ctx, kid=None, count_miss=False):
+        """
+        Adds a context (e.g. loaded from a KeyStore) and evicts the least
+        recently used ones if the budget is exceeded
+
+        :param ctx: KeyContext object
+        :param kid: key id of the context, default computed from ctx.pub
+        :return: returns nothing
+        """
+        self._check_fork()
+        if kid is None:
+            kid = self.key_id(ctx.pub)
+        table = None
+        if ctx.pub.h is not None:
+            table = shortExpTable(ctx.pub) ## counted in the size of the context
+        size = ctx.memory()
+        with self.lock:
+            if count_miss:
+                self.misses += 1
+                self.builds += 1
+            old = self.entries.pop(kid, None)
+            if old is not None:
+                self.memory -= old[1]
+            self.entries[kid] = (ctx, size, table)
+            self.memory += size
+            while self.memory > self.budget and len(self.entries) > 1:
+                old_kid, (old_ctx, old_size, old_table) = self.entries.popitem(last=False)
+                self.memory -= old_size
+                self.evictions += 1
+                self.ids.pop(old_ctx.pub.n, None)
+                if old_table is not None:
+                    short_exp_tables.pop((old_ctx.pub.n_sq, old_ctx.pub.h), None)
+
+    def prewarm(self, keys, store=None):
+        """
+        Builds the contexts of the given keys, e.g. the top tenants at startup
+
+        :param keys: list of public keys, (public key, private key) tuples, or key ids if store is given
+        :param store: KeyStore to load key ids from, default None
+        :return: returns nothing
+        """
+        for key in keys:
+            if store is not None:
+                self.put(store.load(key), key, count_miss=True)
+            elif isinstance(key, tuple):
+                self.get(key[0], key[1])
+            else:
+                self.get(key)
+
+    def stats(self):
+        """
+        :return: dictionary with contexts, hits, misses, builds, evictions and memory
+        """
+        self._check_fork()
+        with self.lock:
+            return {"contexts": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "builds": self.builds, "evictions": self.evictions, "memory": self.memory}
+
+default_cache = KeyContextCache()
+
+def get_context(pub, priv=None):
+    """
+    Returns the context of a key from the process wide registry
+
+    :param pub: public key object
+    :param priv: private key object, default None
+    :return: KeyContext object
+    """
+    return default_cache.get(pub, priv)
+
+
+if __name__ == "__main__":
+    import time
+    import shutil
+    import tempfile
+    import multiprocessing
+
+    print "\n****testing key context cache:****"
+
+    keys = [generateKeys(256, save=False) for _ in xrange(6)]
+    for priv, pub in keys[:3]:
+        pub.enableShortExponent(80)
+
+    try:
+        KeyContextCache(pool_size=40)
+        assert False
+    except Exception as e:
+        print "pool size is checked: ", e
+    cache = KeyContextCache(pool_size=256)
+    start = time.time()
+    cache.prewarm([(pub, priv) for priv, pub in keys[:2]])
+    print "prewarm time (ms): ", (time.time() - start) * 1000
+    start = time.time()
+    ctx = cache.get(keys[0][1])
+    print "warm lookup time (ms): ", (time.time() - start) * 1000
+    assert ctx.decrypt(ctx.encrypt(17)) == 17
+    assert cache.stats()["builds"] == 2 and cache.stats()["hits"] == 1
+
+    pub_only = cache.get(keys[3][1])
+    assert pub_only.crt is None
+    assert ctx.pool == [] and len(pub_only.pool) == 256 ## no pool in short exponent mode
+    assert cache.get(keys[3][1], keys[3][0]).decrypt(pub_only.encrypt(5)) == 5 ## private key added later
+
+    threads = []
+    def worker(pub):
+        for _ in xrange(20):
+            cache.get(pub)
+    for _ in xrange(8):
+        threads.append(threading.Thread(target=worker, args=(keys[4][1],)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print cache.stats()
+    assert cache.stats()["builds"] == 4 ## keys[4] built once by 8 threads
+
+    sizes = [cache.get(pub).memory() for _, pub in keys]
+    small = KeyContextCache(budget=2 * max(sizes))
+    for _, pub in keys:
+        small.get(pub)
+    assert small.evictions > 0 and small.memory <= small.budget
+    assert min(sizes[:3]) > max(sizes[3:]) ## h tables are counted
+    assert (keys[0][1].n_sq, keys[0][1].h) not in short_exp_tables ## and dropped on eviction
+    assert cache.get(keys[0][1]).decrypt(encrypt(keys[0][1], 8)) == 8
+    assert (keys[0][1].n_sq, keys[0][1].h) in short_exp_tables ## put back by the cache that holds it
+    small.get(keys[-1][1])
+    assert small.stats()["hits"] == 1
+
+    path = tempfile.mkdtemp()
+    store = KeyStore(path)
+    kid = store.store(keys[0][0], keys[0][1])
+    stored = KeyContextCache()
+    stored.prewarm([kid], store)
+    assert stored.get(keys[0][1]).decrypt(encrypt(keys[0][1], 9)) == 9
+    assert stored.stats()["builds"] == 1
+    shutil.rmtree(path)
+
+    default_cache.get(keys[5][1], keys[5][0])
+    def forked(m):
+        ctx = get_context(keys[5][1])
+        return ctx.encrypt(m), default_cache.stats()["builds"]
+    pool = multiprocessing.Pool(2)
+    results = pool.map(forked, [3, 3, 3, 3])
+    pool.close()
+    pool.join()
+    assert all(builds == 1 for _, builds in results) ## forked workers reuse the warm context
+    assert len(set(c for c, _ in results)) == 4
+    assert all(decrypt(keys[5][0], keys[5][1], c) == 3 for c, _ in results)
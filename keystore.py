@@ -0,0 +1,455 @@
+import os
+import sys
+import random
+import hashlib
+from paillier import *
+
+"""
+This code implements an on-disk keystore for the paillier keys.
+Every key pair is stored under a key id together with the material that is
+expensive to derive from it (CRT decryption constants, a pool of randomizers
+and the fixed base table of h for keys in short exponent mode), so short lived
+processes can load a ready to use key instead of recomputing it.
+Pool randomizers are products of a random subset of the pool; the subset size is
+chosen so that there are at least 2^POOL_SECURITY subsets, the same entropy as the
+randomizers of the short exponent mode with its default security parameter.
+"""
+
+PRECOMPUTATION_VERSION = 3
+DEFAULT_POOL_SIZE = 512
+POOL_SECURITY = 224
+
+def key_id(pub):
+    """
+    Computes the id of a key, derived from the modulus n
+
+    :param pub: public key object
+    :return: hexadecimal string identifying the key
+    """
+    return hashlib.sha1(str(pub.n)).hexdigest()[:16]
+
+def isqrt(n):
+    """
+    Integer square root, computed with Newton's method
+
+    :param n: non negative number
+    :return: largest x such that x * x <= n
+    """
+    if n == 0:
+        return 0
+    x = n
+    y = (x + 1) // 2
+    while y < x:
+        x = y
+        y = (x + n // x) // 2
+    return x
+
+def pool_subset(size, security=POOL_SECURITY):
+    """
+    Computes the number of pool elements multiplied into each randomizer
+
+    :param size: number of elements of the pool
+    :param security: bits of entropy required, default POOL_SECURITY
+    :return: smallest k such that C(size, k) >= 2^security, or None if the pool is too small
+    """
+    c = 1
+    for k in xrange(1, size // 2 + 1):
+        c = c * (size - k + 1) // k
+        if c.bit_length() > security:
+            return k
+    return None
+
+def atomic_write(filename, save):
+    """
+    Writes a file atomically: the content is written to a temporary file in the
+    same directory which is then renamed over filename
+
+    :param filename: file to write
+    :param save: function that receives a file name and writes the content to it
+    :return: returns nothing
+    """
+    tmp = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        save(tmp)
+        os.rename(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class KeyContext():
+    """
+    Public key (and optionally private key) with its precomputed material:
+    CRT decryption constants, a pool of randomizers r^n mod n^2 and, in short
+    exponent mode, the fixed base table of h
+    """
+
+    def __init__(self, pub, priv=None, pool_size=0):
+        """
+        Constructs a KeyContext object
+
+        :param pub: public key object
+        :param priv: private key object, default None (encryption only)
+        :param pool_size: number of randomizers to precompute, default 0
+        """
+        self.pub = pub
+        self.priv = priv
+        self.crt = None
+        self.pool = []
+        if priv is not None:
+            self.crt = self.compute_crt()
+        if pool_size > 0:
+            self.fill_pool(pool_size)
+
+    def compute_crt(self):
+        """
+        Computes the constants to decrypt modulo p^2 and q^2.
+        The primes are recovered from n and lambda, since p + q = n - lambda + 1
+
+        :return: tuple (p, q, hp, hq, q_inv)
+        """
+        n = self.pub.n
+        s = n - self.priv.lamb + 1
+        d = isqrt(s * s - 4 * n)
+        p = (s + d) // 2
+        q = (s - d) // 2
+        if p * q != n:
+            raise Exception("private key does not match public key")
+        hp = modinv((myExp(self.pub.g, p - 1, p * p) - 1) // p, p)
+        hq = modinv((myExp(self.pub.g, q - 1, q * q) - 1) // q, q)
+        return (p, q, hp, hq, modinv(q, p))
+
+    def fill_pool(self, size):
+        """
+        Adds fresh randomizers r^n mod n^2 to the pool until it has size elements
+
+        :param size: target size of the pool
+        :return: returns nothing
+        """
+        while len(self.pool) < size:
+            r = random.randrange(1, self.pub.n)
+            if gcd(r, self.pub.n) == 1:
+                self.pool.append(myExp(r, self.pub.n, self.pub.n_sq))
+
+    def randomizer(self):
+        """
+        Returns a random r^n mod n^2.
+        In short exponent mode the randomizer is h^t (see shortRandomizer).
+        When the pool is large enough to give POOL_SECURITY bits of entropy the
+        value is the product of a random subset of the pool, so the pool is never
+        consumed and can be shared by many processes, otherwise it is computed
+        from scratch.
+
+        :return: random n-th residue modulo n^2
+        """
+        if self.pub.h is not None:
+            return shortRandomizer(self.pub)
+        k = pool_subset(len(self.pool))
+        if k is None:
+            while True:
+                r = random.randrange(1, self.pub.n)
+                if gcd(r, self.pub.n) == 1:
+                    return myExp(r, self.pub.n, self.pub.n_sq)
+        x = 1
+        for y in random.sample(self.pool, k):
+            x = (x * y) % self.pub.n_sq
+        return x
+
+    def encrypt(self, plain):
+        """
+        Encrypts a message using the randomizer pool
+
+        :param plain: message to encrypt
+        :return: encrypted message
+        """
+        n_sq = self.pub.n_sq
+        if self.pub.g == self.pub.n + 1:
+            g_m = (1 + (plain % self.pub.n) * self.pub.n) % n_sq ## (n + 1)^m = 1 + m*n mod n^2
+        else:
+            g_m = myExp(self.pub.g, plain, n_sq)
+        return (g_m * self.randomizer()) % n_sq
+
+    def decrypt(self, cipher):
+        """
+        Decrypts a message with the CRT constants, computing modulo p^2 and q^2
+        instead of n^2
+
+        :param cipher: encrypted message
+        :return: plain text of cipher message
+        """
+        if self.crt is None:
+            raise Exception("key context has no private key")
+        p, q, hp, hq, q_inv = self.crt
+        p_sq = p * p
+        q_sq = q * q
+        mp = (((myExp(cipher % p_sq, p - 1, p_sq) - 1) // p) * hp) % p
+        mq = (((myExp(cipher % q_sq, q - 1, q_sq) - 1) // q) * hq) % q
+        return mq + (((mp - mq) * q_inv) % p) * q
+
+    def memory(self):
+        """
+        Estimates the memory used by the context
+
+        :return: size in bytes
+        """
+        size = sys.getsizeof(self.pub.n_sq) * (3 + len(self.pool))
+        if self.crt is not None:
+            size += sum(sys.getsizeof(x) for x in self.crt)
+        if self.pub.h is not None:
+            table = short_exp_tables.get((self.pub.n_sq, self.pub.h))
+            if table is not None:
+                size += sys.getsizeof(self.pub.n_sq) * len(table) * len(table[0])
+        return size
+
+    def save_public(self, filename):
+        """
+        Saves the public precomputed material (randomizer pool and table of h)
+        into a versioned text file: a version;n;h header line, a line with the
+        pool and one line per row of the table, values separated by ;
+
+        :param filename: file to save
+        :return: returns nothing
+        """
+        h = "-" if self.pub.h is None else str(self.pub.h)
+        key_file = open(filename, "w")
+        key_file.write("%d;%d;%s\n" % (PRECOMPUTATION_VERSION, self.pub.n, h))
+        key_file.write(";".join(str(x) for x in self.pool) + "\n")
+        if self.pub.h is not None:
+            for row in shortExpTable(self.pub):
+                key_file.write(";".join(str(x) for x in row) + "\n")
+        key_file.close()
+
+    def save_private(self, filename):
+        """
+        Saves the CRT constants into a versioned text file: version;n;p;q;hp;hq;q_inv
+
+        :param filename: file to save
+        :return: returns nothing
+        """
+        key_file = open(filename, "w")
+        key_file.write(";".join(str(x) for x in (PRECOMPUTATION_VERSION, self.pub.n) + self.crt))
+        key_file.close()
+
+    def _read(self, filename):
+        """
+        Reads a precomputation file and checks its version and key
+
+        :param filename: file to read from
+        :return: list of lines, each a list of numbers, without the header
+        """
+        try:
+            key_file = open(filename, "r")
+            lines = key_file.read().split("\n")
+            key_file.close()
+            header = lines[0].split(";")
+            version = int(header[0])
+            n = int(header[1])
+        except:
+            raise Exception("could not load precomputation from file: " + filename)
+        if version != PRECOMPUTATION_VERSION:
+            raise Exception("unsupported precomputation version in file: " + filename)
+        if n != self.pub.n:
+            raise Exception("precomputation does not belong to this key: " + filename)
+        try:
+            return header[2:], [[int(x) for x in line.split(";") if x] for line in lines[1:]]
+        except:
+            raise Exception("could not load precomputation from file: " + filename)
+
+    def load_public(self, filename):
+        """
+        Loads the randomizer pool and the table of h from file
+
+        :param filename: file to read from
+        :return: returns nothing
+        """
+        header, lines = self._read(filename)
+        h = None if header[0] == "-" else int(header[0])
+        if h != self.pub.h:
+            raise Exception("precomputation does not match the short exponent mode: " + filename)
+        self.pool = lines[0]
+        table = [row for row in lines[1:] if row]
+        if table:
+            putShortExpTable(self.pub, table)
+
+    def load_private(self, filename):
+        """
+        Loads the CRT constants from file
+
+        :param filename: file to read from
+        :return: returns nothing
+        """
+        header, lines = self._read(filename)
+        if len(header) != 5:
+            raise Exception("could not load precomputation from file: " + filename)
+        self.crt = tuple(int(x) for x in header)
+
+class KeyStore():
+    """
+    Directory of key pairs indexed by key id. Each key has four files:
+    <id>.pub and <id>.priv in the usual key format, <id>.pre with the public
+    precomputed material and <id>.crt with the CRT constants. The .crt file holds
+    the factors of n, so it must be protected like the private key; encryption
+    only processes need read access to the .pub and .pre files only
+    """
+
+    def __init__(self, path="keystore"):
+        """
+        Constructs a KeyStore object, creating the directory if needed
+
+        :param path: directory of the keystore, default keystore
+        """
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def filename(self, kid, ext):
+        """
+        :param kid: key id
+        :param ext: file extension (pub, priv, pre or crt)
+        :return: path of the file
+        """
+        return os.path.join(self.path, kid + "." + ext)
+
+    def generate(self, bits=256, pool_size=DEFAULT_POOL_SIZE, short_exponent=None):
+        """
+        Generates a new key pair and stores it
+
+        :param bits: key size in bits, default 256
+        :param pool_size: number of randomizers to precompute
+        :param short_exponent: security parameter of the short exponent mode, default None (disabled)
+        :return: key id
+        """
+        priv, pub = generateKeys(bits, save=False)
+        if short_exponent is not None:
+            pub.enableShortExponent(short_exponent)
+        return self.store(priv, pub, pool_size)
+
+    def store(self, priv, pub, pool_size=DEFAULT_POOL_SIZE):
+        """
+        Stores a key pair and its precomputed material
+
+        :param priv: private key object
+        :param pub: public key object
+        :param pool_size: number of randomizers to precompute
+        :return: key id
+        """
+        kid = key_id(pub)
+        if pub.h is not None:
+            pool_size = 0 ## not used in short exponent mode
+        ctx = KeyContext(pub, priv, pool_size)
+        atomic_write(self.filename(kid, "pub"), pub.saveToFile)
+        atomic_write(self.filename(kid, "priv"), priv.saveToFile)
+        atomic_write(self.filename(kid, "pre"), ctx.save_public)
+        atomic_write(self.filename(kid, "crt"), ctx.save_private)
+        return kid
+
+    def load(self, kid, with_private=True):
+        """
+        Loads a key and its precomputed material.
+        If the precomputation is missing or outdated it is rebuilt and stored again
+        (only when the private key is loaded).
+
+        :param kid: key id
+        :param with_private: if False only the .pub and .pre files are read, default True
+        :return: KeyContext object
+        """
+        pub = PublicKey(1, 1)
+        pub.loadKey(self.filename(kid, "pub"))
+        priv = None
+        if with_private:
+            priv = PrivateKey(2, 2)
+            priv.loadKey(self.filename(kid, "priv"))
+        ctx = KeyContext(pub)
+        ctx.priv = priv
+        try:
+            ctx.load_public(self.filename(kid, "pre"))
+            if with_private:
+                ctx.load_private(self.filename(kid, "crt"))
+        except Exception:
+            if priv is None:
+                raise
+            ctx = KeyContext(pub, priv, 0 if pub.h is not None else DEFAULT_POOL_SIZE)
+            atomic_write(self.filename(kid, "pre"), ctx.save_public)
+            atomic_write(self.filename(kid, "crt"), ctx.save_private)
+        return ctx
+
+    def keys(self):
+        """
+        :return: list of the key ids in the keystore
+        """
+        return sorted(f[:-4] for f in os.listdir(self.path) if f.endswith(".pub"))
+
+    def remove(self, kid):
+        """
+        Removes a key and its precomputed material from the keystore
+
+        :param kid: key id
+        :return: returns nothing
+        """
+        for ext in ("crt", "pre", "priv", "pub"):
+            if os.path.exists(self.filename(kid, ext)):
+                os.remove(self.filename(kid, ext))
+
+
+if __name__ == "__main__":
+    import time
+    import shutil
+    import tempfile
+    import paillier
+
+    print "****testing keystore:****"
+
+    path = tempfile.mkdtemp()
+    store = KeyStore(path)
+    kid = store.generate(256)
+    print "stored key: ", kid, store.keys()
+    assert store.keys() == [kid]
+
+    start = time.time()
+    ctx = store.load(kid)
+    print "load time (ms): ", (time.time() - start) * 1000
+
+    m1 = 42
+    x = ctx.encrypt(m1)
+    assert decrypt(ctx.priv, ctx.pub, x) == m1
+    assert ctx.decrypt(x) == m1
+    y = encrypt(ctx.pub, 10)
+    print "CRT decryption: ", m1, " + 10 = ", ctx.decrypt(e_add(ctx.pub, x, y))
+    assert ctx.decrypt(e_add(ctx.pub, x, y)) == m1 + 10
+    assert ctx.encrypt(m1) != ctx.encrypt(m1)
+
+    for ext in ("crt", "priv"):
+        os.rename(store.filename(kid, ext), store.filename(kid, ext) + ".hidden")
+    pub_ctx = store.load(kid, with_private=False) ## only the public files are read
+    for ext in ("crt", "priv"):
+        os.rename(store.filename(kid, ext) + ".hidden", store.filename(kid, ext))
+    assert pub_ctx.priv is None and pub_ctx.crt is None and len(pub_ctx.pool) == DEFAULT_POOL_SIZE
+    assert decrypt(ctx.priv, ctx.pub, pub_ctx.encrypt(7)) == 7
+    assert pool_subset(DEFAULT_POOL_SIZE) is not None and pool_subset(128) is None
+
+    pre = open(store.filename(kid, "pre")).read()
+    assert "pickle" not in pre and pre.split("\n")[0].split(";")[0] == str(PRECOMPUTATION_VERSION)
+
+    os.remove(store.filename(kid, "crt"))
+    assert store.load(kid).decrypt(x) == m1 ## precomputation is rebuilt
+    assert os.path.exists(store.filename(kid, "crt"))
+
+    short_kid = store.generate(256, short_exponent=80)
+    paillier.short_exp_tables.clear()
+    builds = []
+    window_table = paillier.windowTable
+    paillier.windowTable = lambda *args: builds.append(1) or window_table(*args)
+    ctx = store.load(short_kid)
+    assert ctx.pub.t_bits == 160 and len(paillier.short_exp_tables) == 1 and ctx.pool == []
+    assert ctx.decrypt(ctx.encrypt(m1)) == m1
+    assert builds == [] ## table comes from the .pre file
+    os.remove(store.filename(short_kid, "pre"))
+    paillier.short_exp_tables.clear()
+    ctx = store.load(short_kid)
+    assert builds == [1] and ctx.pool == [] ## rebuilt once, without a pool
+    paillier.windowTable = window_table
+    assert ctx.decrypt(encrypt(ctx.pub, m1)) == m1
+    assert ctx.decrypt(ctx.encrypt(m1)) == m1
+    store.remove(short_kid)
+    store.remove(kid)
+    assert store.keys() == []
+    shutil.rmtree(path)
@@ -0,0 +1,151 @@
+from paillier import *
+from boosted_paillier import *
+
+"""
+This code implements the packing of several small results into one ciphertext before
+decryption. k ciphers are combined as sum c_i * 2^(slot_bits * i) (Horner's rule, so the
+scaling is only squarings), which costs one decryption instead of k, and the decrypted
+value is split back into the k results with unpack.
+Each result must fit in slot_bits bits (signed results in slot_bits - 1 bits plus the
+sign) and k * slot_bits must be smaller than the size of n.
+"""
+
+def check_capacity(pub, k, slot_bits):
+    """
+    Verifies that k slots of slot_bits bits fit in the plaintext space
+
+    :param pub: public key object
+    :param k: number of slots
+    :param slot_bits: bits per slot
+    :return: returns nothing
+    """
+    if k * slot_bits >= pub.n.bit_length() - 1:
+        raise Exception("%d slots of %d bits do not fit in a %d bit key" % (k, slot_bits, pub.n.bit_length()))
+
+def pack(pub, ciphers, slot_bits=64):
+    """
+    Packs paillier ciphertexts into one
+
+    :param pub: public key object
+    :param ciphers: list of ciphertexts, the first one goes to the lowest slot
+    :param slot_bits: bits per slot, default 64
+    :return: encryption of sum m_i * 2^(slot_bits * i)
+    """
+    check_capacity(pub, len(ciphers), slot_bits)
+    shift = 1 << slot_bits
+    packed = ciphers[-1]
+    for c in reversed(ciphers[:-1]):
+        packed = e_add(pub, e_mul_const(pub, packed, shift), c)
+    return packed
+
+def pack1(pub, ciphers, slot_bits=64):
+    """
+    Packs level 1 ciphers into one: the a parts are folded in plain and the
+    b parts are packed as ciphertexts
+
+    :param pub: public key object
+    :param ciphers: list of level 1 ciphers, the first one goes to the lowest slot
+    :param slot_bits: bits per slot, default 64
+    :return: level 1 cipher of sum m_i * 2^(slot_bits * i)
+    """
+    a = 0
+    for c in reversed(ciphers):
+        a = ((a << slot_bits) + c.a) % pub.n
+    return CipherLevel1(a, pack(pub, [c.b for c in ciphers], slot_bits))
+
+def pack2(pub, ciphers, slot_bits=64):
+    """
+    Packs level 2 ciphers into one. The a parts are packed as ciphertexts and
+    the first element of every pair is scaled to the slot of its cipher, so the
+    pairs are kept (their decryption is not amortized)
+
+    :param pub: public key object
+    :param ciphers: list of level 2 ciphers, the first one goes to the lowest slot
+    :param slot_bits: bits per slot, default 64
+    :return: level 2 cipher of sum m_i * 2^(slot_bits * i)
+    """
+    a = pack(pub, [c.a for c in ciphers], slot_bits)
+    b = []
+    for i, c in enumerate(ciphers):
+        scale = 1 << (slot_bits * i)
+        for x in c.b:
+            b.append([e_mul_const(pub, x[0], scale), x[1]])
+    return CipherLevel2(a, b)
+
+def unpack(plain, k, slot_bits=64, signed=False, pub=None):
+    """
+    Splits a decrypted packed value into its k results
+
+    :param plain: decrypted packed value
+    :param k: number of slots
+    :param slot_bits: bits per slot, default 64
+    :param signed: True if the results can be negative, default False
+    :param pub: public key object, needed when signed is True
+    :return: list of k results, lowest slot first
+    """
+    mask = (1 << slot_bits) - 1
+    if signed:
+        if pub is None:
+            raise Exception("public key is needed to unpack signed values")
+        if plain > pub.n // 2:
+            plain -= pub.n
+    values = []
+    for _ in xrange(k):
+        v = plain & mask
+        if signed and v >> (slot_bits - 1):
+            v -= 1 << slot_bits
+        values.append(v)
+        plain = (plain - v) >> slot_bits
+    return values
+
+
+if __name__ == "__main__":
+    import time
+
+    print "\n****testing packing:****"
+
+    priv, pub = generateKeys(512, save=False)
+    pub.enableShortExponent()
+    slot_bits = 48
+    k = 8
+    values = [random.randrange(0, 1 << 40) for _ in xrange(k)]
+    ciphers = [encrypt(pub, v) for v in values]
+
+    start = time.time()
+    separate = [decrypt(priv, pub, c) for c in ciphers]
+    separate_time = time.time() - start
+    start = time.time()
+    packed = unpack(decrypt(priv, pub, pack(pub, ciphers, slot_bits)), k, slot_bits)
+    packed_time = time.time() - start
+    print "packed ", k, " results: ", packed == values, " decrypt separately: ", round(separate_time, 4), \
+        "s pack + decrypt: ", round(packed_time, 4), "s"
+    assert packed == values == separate
+
+    negatives = [random.randrange(-(1 << 30), 1 << 30) for _ in xrange(k)]
+    ciphers = [encrypt(pub, v % pub.n) for v in negatives]
+    assert unpack(decrypt(priv, pub, pack(pub, ciphers, slot_bits)), k, slot_bits, True, pub) == negatives
+
+    level1 = []
+    for v in values:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, v)
+        level1.append(c)
+    totals = [add1(level1[i], level1[i + 1], pub) for i in xrange(0, k, 2)]
+    assert unpack(pack1(pub, totals, slot_bits).get_value(priv, pub), k // 2, slot_bits) == \
+        [values[i] + values[i + 1] for i in xrange(0, k, 2)]
+
+    small = [random.randrange(0, 1 << 20) for _ in xrange(4)]
+    level1 = []
+    for v in small:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, v)
+        level1.append(c)
+    products = [mult1(level1[i], level1[i + 1], pub) for i in xrange(0, 4, 2)]
+    assert unpack(pack2(pub, products, slot_bits).get_value(priv, pub), 2, slot_bits) == \
+        [small[0] * small[1], small[2] * small[3]]
+
+    try:
+        pack(pub, ciphers, 64)
+        assert False
+    except Exception as e:
+        print "capacity is checked: ", e
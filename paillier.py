@@ -1,6 +1,7 @@
 import random
 import math
 from fractions import gcd
+from collections import OrderedDict
 
 """
 This piece of code implements the traditional paillier hommomorphic cryptosystem.
@@ -67,6 +68,24 @@ class PublicKey():
         self.n = p * q
         self.n_sq = self.n * self.n
         self.g = self.n + 1
+        self.h = None ## generator of the short exponent mode, see enableShortExponent
+        self.t_bits = None
+
+    def enableShortExponent(self, security=112):
+        """
+        Enables the short exponent encryption mode: a generator h = x^n mod n^2
+        is published and encryptions use h^t as randomizer, where t has
+        2 * security bits instead of the log n bits of r in r^n
+        
+        :param security: security parameter in bits, default 112
+        :return: returns nothing
+        """
+        while True:
+            x = random.randrange(2, self.n)
+            if gcd(x, self.n) == 1:
+                break
+        self.h = myExp(x, self.n, self.n_sq)
+        self.t_bits = 2 * security
     
     def loadKey (self, filename="pub.key"):
         """
@@ -82,6 +101,11 @@ class PublicKey():
             self.n = int(aux[0])
             self.n_sq = int(aux[1])
             self.g = int(aux[2])
+            self.h = None
+            self.t_bits = None
+            if len(aux) > 4:
+                self.h = int(aux[3])
+                self.t_bits = int(aux[4])
         except:
             raise Exception("could not load key from file: " + filename)
     
@@ -94,9 +118,17 @@ class PublicKey():
         """
         key_file = open(filename, "w")
         key_file.write(str(self.n) + ";" + str(self.n_sq) + ";" + str(self.g))
+        if self.h is not None:
+            key_file.write(";" + str(self.h) + ";" + str(self.t_bits))
         key_file.close()
 
 
+mul_const_cache = None ## exponentiation table cache used by e_mul_const, see exp_cache.install
+INVERSE_CACHE_SIZE = 1024
+inverse_cache = OrderedDict() ## last inverses computed by e_inv
+SHORT_EXP_TABLES_SIZE = 16
+short_exp_tables = OrderedDict() ## last fixed base tables of h, indexed by (n^2, h)
+
 smallprimes = (2,3,5,7,11,13,17,19,23,29,31,37,41,43,47,53,59,61,67,71,73,79,83,89,97)
 
 def egcd(a, b):
@@ -109,11 +141,13 @@ def egcd(a, b):
     :param b: b value
     :return: greatest common divisor and coefficients of Bezout's identity
     """
-    if a == 0:
-        return (b, 0, 1)
-    else:
-        g, y, x = egcd(b % a, a)
-        return (g, x - (b // a) * y, y)
+    x0, y0, x1, y1 = 0, 1, 1, 0 ##iterative, the recursion is too deep for 2048 bit keys
+    while a != 0:
+        q = b // a
+        a, b = b % a, a
+        x0, x1 = x1, x0 - q * x1
+        y0, y1 = y1, y0 - q * y1
+    return (b, x0, y0)
 
 def modinv(a, m):
     """
@@ -161,6 +195,72 @@ def myExp(base,exponent,modulus):
         base = (base * base) % modulus
     return result
 
+def multiExp(bases, exponents, modulus):
+    """
+    Calculates the product of base_i ^ exponent_i % modulus with a single
+    chain of squarings shared by all the bases (Shamir's trick)
+
+    :param bases: list of base numbers
+    :param exponents: list of exponent numbers
+    :param modulus: modulos number
+    :return: (prod base_i^exponent_i) % modulus
+    """
+    pairs = [(b % modulus, e) for b, e in zip(bases, exponents) if e > 0]
+    if not pairs:
+        return 1
+    result = 1
+    for i in xrange(max(e for _, e in pairs).bit_length() - 1, -1, -1):
+        result = (result * result) % modulus
+        for b, e in pairs:
+            if (e >> i) & 1:
+                result = (result * b) % modulus
+    return result
+
+def windowTable(base, bits, modulus, window=4):
+    """
+    Precomputes a fixed base table to calculate base ^ exponent % modulus
+    for any exponent of up to bits bits. Row i holds base^(j * 2^(window*i))
+    for j < 2^window.
+
+    :param base: base number
+    :param bits: maximum number of bits of the exponents
+    :param modulus: modulos number
+    :param window: window size in bits, default 4
+    :return: table (list of rows)
+    """
+    table = []
+    for _ in xrange((bits + window - 1) // window):
+        row = [1, base % modulus]
+        for _ in xrange(2, 1 << window):
+            row.append((row[-1] * base) % modulus)
+        table.append(row)
+        base = (row[-1] * base) % modulus ## base^(2^window)
+    return table
+
+def windowExp(table, exponent, modulus, window=4):
+    """
+    Calculates base ^ exponent % modulus with a table built by windowTable,
+    using only one multiplication per window and no squarings
+
+    :param table: fixed base table of base
+    :param exponent: exponent number
+    :param modulus: modulos number
+    :param window: window size used to build the table, default 4
+    :return: (base^exponent) % modulus
+    """
+    if exponent >> (window * len(table)):
+        raise Exception("exponent is too large for the table")
+    mask = (1 << window) - 1
+    result = 1
+    i = 0
+    while exponent > 0:
+        digit = exponent & mask
+        if digit:
+            result = (result * table[i][digit]) % modulus
+        exponent >>= window
+        i += 1
+    return result
+
 def isPrime(p):
     """
     Rabin Millers algorithm to test if a number is prime
@@ -207,11 +307,12 @@ def generatePrime(size):
         if isPrime(possible_prime):
             return possible_prime
     
-def generateKeys(bits=256):
+def generateKeys(bits=256, save=True):
     """
     Generates a key pair and stores it in priv.key and pub.key files
     
     :param bits: key size in bits, default 256
+    :param save: if False the keys are not written to priv.key and pub.key, default True
     :return: tuple of private key and public key objects
     """
     #print "generating first prime number"
@@ -226,26 +327,73 @@ def generateKeys(bits=256):
     priv = PrivateKey(p, q)
     pub = PublicKey(p, q)
     
-    priv.saveToFile()
-    pub.saveToFile()
+    if save:
+        priv.saveToFile()
+        pub.saveToFile()
     
     return priv, pub
     
+def putShortExpTable(pub, table):
+    """
+    Stores the fixed base table of h (e.g. loaded from disk). Only the last
+    SHORT_EXP_TABLES_SIZE tables used are kept
+    
+    :param pub: public key object in short exponent mode
+    :param table: window table of h
+    :return: returns nothing
+    """
+    key = (pub.n_sq, pub.h)
+    short_exp_tables.pop(key, None)
+    while len(short_exp_tables) >= SHORT_EXP_TABLES_SIZE:
+        short_exp_tables.popitem(last=False)
+    short_exp_tables[key] = table
+
+def shortExpTable(pub):
+    """
+    Returns the fixed base table of h, building it on first use
+    
+    :param pub: public key object in short exponent mode
+    :return: window table of h for exponents of t_bits bits
+    """
+    key = (pub.n_sq, pub.h)
+    table = short_exp_tables.pop(key, None)
+    if table is None:
+        table = windowTable(pub.h, pub.t_bits, pub.n_sq)
+        putShortExpTable(pub, table)
+    else:
+        short_exp_tables[key] = table
+    return table
+
+def shortRandomizer(pub):
+    """
+    Computes the randomizer h^t mod n^2 of the short exponent mode, with t a
+    random number of t_bits bits
+    
+    :param pub: public key object in short exponent mode
+    :return: random n-th residue modulo n^2
+    """
+    t = random.getrandbits(pub.t_bits)
+    return windowExp(shortExpTable(pub), t, pub.n_sq)
+
 def encrypt(pub, plain):
     """
-    Encrypts a message
+    Encrypts a message.
+    If the key is in short exponent mode the randomizer is h^t instead of r^n
     
     :param pub: public key object
     :param plain: message to encrypt
     :return: encrypted message
     """
-    ##according to source, it is required to generate a random, however encryption works fine even if r is not random.
-    ## is it more safe to generate a prime r?...
-    while True: 
-        r = generatePrime(long(round(math.log(pub.n, 2))))
-        if r > 0 and r < pub.n:
-            break
-    x = myExp(r, pub.n, pub.n_sq)
+    if pub.h is not None:
+        x = shortRandomizer(pub)
+    else:
+        ##according to source, it is required to generate a random, however encryption works fine even if r is not random.
+        ## is it more safe to generate a prime r?...
+        while True: 
+            r = generatePrime(long(round(math.log(pub.n, 2))))
+            if r > 0 and r < pub.n:
+                break
+        x = myExp(r, pub.n, pub.n_sq)
     cipher = (myExp(pub.g, plain, pub.n_sq) * x) % pub.n_sq
     return cipher
     
@@ -284,17 +432,54 @@ def e_add_const(pub, a, n):
     :param n: constant n
     :return: a + n, encrypted
     """
-    return a * myExp(pub.g, n, pub.n_sq) % pub.n_sq
-    
+    return a * myExp(pub.g, n % pub.n, pub.n_sq) % pub.n_sq
+
+def e_inv(pub, a):
+    """
+    Computes the inverse of cipher a modulo n^2, which is an encryption of -a.
+    The last inverses are cached since the same cipher is usually scaled by
+    several negative constants.
+
+    :param pub: public key object
+    :param a: cipher value of a
+    :return: -a, encrypted
+    """
+    key = (pub.n_sq, a)
+    inv = inverse_cache.pop(key, None)
+    if inv is None:
+        inv = modinv(a, pub.n_sq)
+        if len(inverse_cache) >= INVERSE_CACHE_SIZE:
+            inverse_cache.popitem(last=False)
+    inverse_cache[key] = inv
+    return inv
+
 def e_mul_const(pub, a, n):
     """
-    Multiplies cipher a by constant n
+    Multiplies cipher a by constant n.
+    n can be negative. Cheap constants are dispatched before the exponentiation:
+    0 and 1 cost nothing (the result is not re-randomized), powers of two are
+    squarings and constants above n/2 (negative numbers) are computed as the
+    inverse of a raised to n - constant.
     
     :param pub: public key object
     :param a: cipher value of a
     :param n: constant n
     :return: a * b, encrypted
     """
+    n = n % pub.n
+    if n > pub.n // 2:
+        a = e_inv(pub, a)
+        n = pub.n - n
+    if n == 0:
+        return 1
+    if n == 1:
+        return a
+    if n & (n - 1) == 0:
+        for _ in xrange(n.bit_length() - 1):
+            a = (a * a) % pub.n_sq
+        return a
+    if mul_const_cache is not None:
+        return mul_const_cache.power(pub, a, n)
     return myExp(a, n, pub.n_sq)
     
     
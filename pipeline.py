@@ -0,0 +1,372 @@
+import os
+import csv
+import time
+import struct
+import multiprocessing
+from collections import deque
+from paillier import *
+from boosted_paillier import *
+
+"""
+This code implements a streaming pipeline to encrypt and aggregate a numeric column.
+The stages are generators: read -> encode -> encrypt (process pool) -> aggregate -> write,
+so only a bounded number of chunks is in memory at any time, whatever the input size.
+The sum is kept as a level 1 cipher and the sum of squares as a level 2 cipher whose
+b pairs are streamed to disk instead of being kept in a list.
+"""
+
+class Progress():
+    """
+    Progress and throughput metrics of a pipeline run
+    """
+
+    def __init__(self):
+        """
+        Constructs a Progress object
+        """
+        self.rows = 0
+        self.chunks = 0
+        self.start = time.time()
+
+    def elapsed(self):
+        """
+        :return: seconds since the run started
+        """
+        return time.time() - self.start
+
+    def rate(self):
+        """
+        :return: rows per second
+        """
+        elapsed = self.elapsed()
+        if elapsed == 0:
+            return 0.0
+        return self.rows / elapsed
+
+def print_progress(progress):
+    """
+    Report function that prints the progress of a run
+
+    :param progress: Progress object
+    :return: returns nothing
+    """
+    print "rows: ", progress.rows, " chunks: ", progress.chunks, " rows/s: ", round(progress.rate(), 1)
+
+class PairFile():
+    """
+    b part of a level 2 cipher stored on disk, one b per line.
+    Iterating yields the pairs [b, b] of a sum of squares, so it can be used
+    as the b list of a CipherLevel2 for get_value.
+    """
+
+    def __init__(self, filename):
+        """
+        Constructs a PairFile object
+
+        :param filename: file with one b value per line
+        """
+        self.filename = filename
+
+    def __iter__(self):
+        b_file = open(self.filename, "r")
+        try:
+            for line in b_file:
+                b = int(line)
+                yield [b, b]
+        finally:
+            b_file.close()
+
+class EncryptedAggregate():
+    """
+    Result of a pipeline run: number of rows, level 1 cipher of the sum and
+    level 2 cipher of the sum of squares (None if not computed)
+    """
+
+    def __init__(self, count, total, total_sq):
+        """
+        Constructs an EncryptedAggregate object
+        """
+        self.count = count
+        self.sum = total
+        self.sum_sq = total_sq
+
+def read_csv_column(filename, column=0, header=True):
+    """
+    Reads a column of a csv file, one row at a time
+
+    :param filename: csv file
+    :param column: column index, or column name if the file has a header
+    :param header: True if the first row is a header, default True
+    :return: generator of the column values (strings)
+    """
+    csv_file = open(filename, "rb")
+    try:
+        reader = csv.reader(csv_file)
+        if header:
+            names = reader.next()
+            if not isinstance(column, (int, long)):
+                column = names.index(column)
+        for row in reader:
+            if row:
+                yield row[column]
+    finally:
+        csv_file.close()
+
+def read_binary_column(filename, fmt="<q", column=0, records=4096):
+    """
+    Reads a field of a binary file of fixed size records
+
+    :param filename: binary file
+    :param fmt: struct format of a record, default one little endian 64 bit integer
+    :param column: index of the field in the record, default 0
+    :param records: number of records read at once, default 4096
+    :return: generator of the field values
+    """
+    record = struct.Struct(fmt)
+    bin_file = open(filename, "rb")
+    try:
+        while True:
+            data = bin_file.read(record.size * records)
+            if not data:
+                break
+            for i in xrange(len(data) // record.size):
+                yield record.unpack_from(data, i * record.size)[column]
+    finally:
+        bin_file.close()
+
+def encode(values, pub, scale=1):
+    """
+    Encodes values as plaintexts: they are multiplied by scale, rounded and
+    negative numbers are represented as n - x
+
+    :param values: iterable of numbers (or strings of numbers)
+    :param pub: public key object
+    :param scale: fixed point scale, default 1
+    :return: generator of plaintexts
+    """
+    for v in values:
+        if isinstance(v, str):
+            v = float(v) if "." in v or "e" in v.lower() else int(v)
+        yield long(round(v * scale)) % pub.n
+
+def decode(plain, pub, scale=1):
+    """
+    Inverse of encode for a decrypted value
+
+    :param plain: decrypted value
+    :param pub: public key object
+    :param scale: fixed point scale used to encode, default 1
+    :return: signed value
+    """
+    if plain > pub.n // 2:
+        plain -= pub.n
+    if scale == 1:
+        return plain
+    return plain / float(scale)
+
+def chunks(values, chunk_size):
+    """
+    Groups an iterable into lists of chunk_size elements
+
+    :param values: iterable
+    :param chunk_size: size of each chunk
+    :return: generator of lists
+    """
+    chunk = []
+    for v in values:
+        chunk.append(v)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def encrypt_chunk(args):
+    """
+    Worker function: encrypts a chunk of plaintexts and aggregates it
+
+    :param args: tuple (public key, list of plaintexts, squares flag)
+    :return: tuple (rows, level 1 sum, a of the sum of squares, list of b values)
+    """
+    pub, chunk, squares = args
+    total = None
+    sq_a = None
+    plain = 0
+    cross = 1
+    bs = []
+    for m in chunk:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, m)
+        total = c if total is None else add1(total, c, pub)
+        if squares:
+            ## a of mult1(c, c) is enc(a^2) * b^(2a), the a^2 are added in plain
+            plain += c.a * c.a
+            cross = cross * myExp(c.b, (2 * c.a) % pub.n, pub.n_sq) % pub.n_sq
+            bs.append(c.b)
+    if squares and chunk:
+        sq_a = e_add_const(pub, cross, plain % pub.n)
+    return len(chunk), total, sq_a, bs
+
+def encrypt_stage(pub, chunk_iter, pool, squares=True, max_inflight=4):
+    """
+    Sends the chunks to the process pool, with at most max_inflight chunks
+    waiting at any time (the next chunk is only read when a result is consumed)
+
+    :param pub: public key object
+    :param chunk_iter: iterable of lists of plaintexts
+    :param pool: multiprocessing pool
+    :param squares: compute the sum of squares, default True
+    :param max_inflight: maximum number of chunks submitted and not consumed
+    :return: generator of encrypt_chunk results, in order
+    """
+    pending = deque()
+    for chunk in chunk_iter:
+        pending.append(pool.apply_async(encrypt_chunk, ((pub, chunk, squares),)))
+        if len(pending) >= max_inflight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def aggregate_stage(pub, results, b_file=None, report=None, report_every=1.0):
+    """
+    Aggregates the chunk results; the b values of the sum of squares are
+    written to b_file as they arrive
+
+    :param pub: public key object
+    :param results: iterable of encrypt_chunk results
+    :param b_file: open file for the b values, None if squares are not computed
+    :param report: function called with a Progress object, default None
+    :param report_every: seconds between reports, default 1
+    :return: tuple (Progress, level 1 sum, a of the sum of squares)
+    """
+    progress = Progress()
+    last_report = progress.start
+    total = None
+    sq_a = None
+    for rows, c, a, bs in results:
+        total = c if total is None else add1(total, c, pub)
+        if a is not None:
+            sq_a = a if sq_a is None else e_add(pub, sq_a, a)
+        if b_file is not None:
+            b_file.write("".join(str(b) + "\n" for b in bs))
+        progress.rows += rows
+        progress.chunks += 1
+        if report is not None and time.time() - last_report >= report_every:
+            report(progress)
+            last_report = time.time()
+    if report is not None:
+        report(progress)
+    return progress, total, sq_a
+
+def write_result(filename, result):
+    """
+    Writes an aggregate into a file, as count;sum.a;sum.b;sum_sq.a.
+    The b values of the sum of squares are in filename + ".b"
+
+    :param filename: file to save
+    :param result: EncryptedAggregate object
+    :return: returns nothing
+    """
+    sq_a = "" if result.sum_sq is None else str(result.sum_sq.a)
+    out = open(filename, "w")
+    out.write(str(result.count) + ";" + str(result.sum.a) + ";" + str(result.sum.b) + ";" + sq_a)
+    out.close()
+
+def load_result(filename):
+    """
+    Loads an aggregate written by write_result
+
+    :param filename: file to read from
+    :return: EncryptedAggregate object
+    """
+    try:
+        res_file = open(filename, "r")
+        aux = res_file.read().split(";")
+        res_file.close()
+    except:
+        raise Exception("could not load aggregate from file: " + filename)
+    total_sq = None
+    if aux[3]:
+        total_sq = CipherLevel2(int(aux[3]), PairFile(filename + ".b"))
+    return EncryptedAggregate(int(aux[0]), CipherLevel1(int(aux[1]), int(aux[2])), total_sq)
+
+def run_pipeline(pub, plains, filename, squares=True, processes=None, chunk_size=256,
+                 max_inflight=None, report=None, report_every=1.0):
+    """
+    Encrypts and aggregates a stream of plaintexts, writing the result to filename.
+    Memory is bounded by chunk_size * max_inflight plaintexts.
+
+    :param pub: public key object
+    :param plains: iterable of plaintexts (see encode)
+    :param filename: file for the result
+    :param squares: compute the sum of squares, default True
+    :param processes: number of worker processes, default number of cpus
+    :param chunk_size: plaintexts per task, default 256
+    :param max_inflight: maximum number of chunks in flight, default 2 * processes
+    :param report: function called with a Progress object, default None
+    :param report_every: seconds between reports, default 1
+    :return: EncryptedAggregate object
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if max_inflight is None:
+        max_inflight = 2 * processes
+    pool = multiprocessing.Pool(processes)
+    b_file = open(filename + ".b", "w") if squares else None
+    try:
+        results = encrypt_stage(pub, chunks(plains, chunk_size), pool, squares, max_inflight)
+        progress, total, sq_a = aggregate_stage(pub, results, b_file, report, report_every)
+        pool.close()
+    finally:
+        pool.terminate()
+        if b_file is not None:
+            b_file.close()
+    if total is None:
+        raise Exception("no values to aggregate")
+    total_sq = None
+    if squares:
+        total_sq = CipherLevel2(sq_a, PairFile(filename + ".b"))
+    result = EncryptedAggregate(progress.rows, total, total_sq)
+    write_result(filename, result)
+    return result
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+
+    print "\n****testing streaming pipeline:****"
+
+    priv, pub = generateKeys(256, save=False)
+    path = tempfile.mkdtemp()
+    values = [random.randrange(-1000, 1000) for _ in xrange(100)]
+
+    csv_name = os.path.join(path, "data.csv")
+    csv_file = open(csv_name, "w")
+    csv_file.write("id,value\n")
+    for i, v in enumerate(values):
+        csv_file.write(str(i) + "," + str(v) + "\n")
+    csv_file.close()
+
+    out = os.path.join(path, "result")
+    plains = encode(read_csv_column(csv_name, "value"), pub)
+    res = run_pipeline(pub, plains, out, processes=2, chunk_size=10, report=print_progress)
+    res = load_result(out)
+    total = decode(res.sum.get_value(priv, pub), pub)
+    total_sq = decode(res.sum_sq.get_value(priv, pub), pub)
+    print "sum: ", sum(values), " = ", total
+    print "sum of squares: ", sum(v * v for v in values), " = ", total_sq
+    assert res.count == len(values)
+    assert total == sum(values)
+    assert total_sq == sum(v * v for v in values)
+
+    bin_name = os.path.join(path, "data.bin")
+    bin_file = open(bin_name, "wb")
+    for v in values:
+        bin_file.write(struct.pack("<q", v))
+    bin_file.close()
+    plains = encode(read_binary_column(bin_name, records=8), pub)
+    res = run_pipeline(pub, plains, out, squares=False, processes=2, chunk_size=16)
+    assert decode(res.sum.get_value(priv, pub), pub) == sum(values)
+    assert res.sum_sq is None
+    shutil.rmtree(path)
@@ -0,0 +1,296 @@
+import os
+import hashlib
+from paillier import *
+from boosted_paillier import *
+from aggregation import serialize, deserialize
+from keystore import atomic_write, key_id
+
+"""
+This code implements an index of encrypted prefix sums over a column of ciphertexts.
+Entry i of the index holds the encryption of c_0 + ... + c_(i-1), so the sum of any range
+[i, j) is one homomorphic subtraction, prefix[j] * prefix[i]^-1 mod n^2, instead of j - i
+additions. The result is the same ciphertext the chain of additions would give.
+Paillier ciphertexts and level 1 ciphers are supported; for level 1 ciphers the plain a
+parts are summed modulo n next to the encrypted b parts.
+Appending a cipher costs one addition. The index is saved as a text file next to the
+column (data file + ".prefix"), one prefix per line, and appends only add a line.
+The fixed width header of the file holds the key id, the number of indexed ciphers and
+a chained sha1 digest of their lines, updated in place on every append. build_index
+checks the digest against the beginning of the column, so reopening an indexed column
+only hashes its lines and adds the new ciphers; it rebuilds the index if the column
+was rewritten.
+"""
+
+EMPTY_DIGEST = "0" * 40
+
+def next_digest(digest, line):
+    """
+    :param digest: digest of the previous lines
+    :param line: serialized cipher, as written by aggregation.write_file
+    :return: digest of the previous lines followed by line
+    """
+    return hashlib.sha1(digest + line.strip()).hexdigest()
+
+def index_file(filename):
+    """
+    :param filename: file of the ciphertext column
+    :return: name of its index file
+    """
+    return filename + ".prefix"
+
+class PrefixIndex():
+    """
+    Encrypted prefix sums of a column of paillier ciphertexts or level 1 ciphers
+    """
+
+    def __init__(self, pub, level1=False):
+        """
+        Constructs an empty PrefixIndex object
+
+        :param pub: public key object
+        :param level1: True if the column holds level 1 ciphers, default False
+        """
+        self.pub = pub
+        self.level1 = level1
+        self.filename = None
+        self.digest = EMPTY_DIGEST
+        if level1:
+            self.prefix = [CipherLevel1(0, 1)] ## 1 is an encryption of 0
+        else:
+            self.prefix = [1]
+
+    def __len__(self):
+        return len(self.prefix) - 1
+
+    def _add(self, s, c):
+        if self.level1:
+            return CipherLevel1((s.a + c.a) % self.pub.n, e_add(self.pub, s.b, c.b))
+        return e_add(self.pub, s, c)
+
+    def append(self, c):
+        """
+        Adds a cipher at the end of the column
+
+        :param c: paillier ciphertext or level 1 cipher
+        :return: returns nothing
+        """
+        self.extend([c])
+
+    def extend(self, ciphers):
+        """
+        Adds several ciphers at the end of the column. If the index was saved or
+        loaded from a file, the new prefixes are appended to it.
+
+        :param ciphers: iterable of paillier ciphertexts or level 1 ciphers
+        :return: returns nothing
+        """
+        ciphers = list(ciphers)
+        for c in ciphers:
+            if isinstance(c, CipherLevel1) != self.level1:
+                raise Exception("cipher kind does not match the index")
+        start = len(self.prefix)
+        for c in ciphers:
+            self.prefix.append(self._add(self.prefix[-1], c))
+            self.digest = next_digest(self.digest, serialize(c))
+        if self.filename is not None and len(self.prefix) > start:
+            out = open(self.filename, "a")
+            for s in self.prefix[start:]:
+                out.write(serialize(s) + "\n")
+            out.close()
+            out = open(self.filename, "r+")
+            out.write(self.header())
+            out.close()
+
+    def header(self):
+        """
+        :return: fixed width first line of the index file
+        """
+        return "K:%s;%012d;%s\n" % (key_id(self.pub), len(self), self.digest)
+
+    def range_sum(self, i, j):
+        """
+        Sum of the ciphers in positions [i, j)
+
+        :param i: first position
+        :param j: position after the last one
+        :return: paillier ciphertext or level 1 cipher of the sum
+        """
+        if not 0 <= i <= j <= len(self):
+            raise Exception("range [%d, %d) out of bounds for %d ciphers" % (i, j, len(self)))
+        high = self.prefix[j]
+        low = self.prefix[i]
+        if self.level1:
+            b = high.b * modinv(low.b, self.pub.n_sq) % self.pub.n_sq
+            return CipherLevel1((high.a - low.a) % self.pub.n, b)
+        return high * modinv(low, self.pub.n_sq) % self.pub.n_sq
+
+    def total(self):
+        """
+        :return: sum of the whole column
+        """
+        return self.prefix[-1]
+
+    def save(self, filename):
+        """
+        Saves the index; later appends are written to the same file
+
+        :param filename: file to save, usually index_file(data file)
+        :return: returns nothing
+        """
+        def save(tmp):
+            out = open(tmp, "w")
+            out.write(self.header())
+            for s in self.prefix:
+                out.write(serialize(s) + "\n")
+            out.close()
+        atomic_write(filename, save)
+        self.filename = filename
+
+def load_index(filename, pub):
+    """
+    Reads an index saved with PrefixIndex.save
+
+    :param filename: index file
+    :param pub: public key object
+    :return: PrefixIndex object
+    """
+    in_file = open(filename, "r")
+    try:
+        header = in_file.readline().strip()[2:].split(";")
+        if header[0] != key_id(pub):
+            raise Exception("index " + filename + " was built with another key")
+        if len(header) != 3:
+            raise Exception("index " + filename + " has no length and digest")
+        prefix = [deserialize(line) for line in in_file if line.strip()]
+    finally:
+        in_file.close()
+    if len(prefix) != int(header[1]) + 1:
+        raise Exception("index " + filename + " was not completely written")
+    index = PrefixIndex(pub, isinstance(prefix[0], CipherLevel1))
+    index.prefix = prefix
+    index.digest = header[2]
+    index.filename = filename
+    return index
+
+def build_index(filename, pub):
+    """
+    Builds the index of a column saved with aggregation.write_file and saves it
+    next to the column. If an index is already there and its digest matches the
+    beginning of the column it is reused and extended with the new ciphers,
+    otherwise it is rebuilt
+
+    :param filename: file of the ciphertext column
+    :param pub: public key object
+    :return: PrefixIndex object
+    """
+    name = index_file(filename)
+    in_file = open(filename, "r")
+    try:
+        lines = [line.strip() for line in in_file if line.strip()]
+    finally:
+        in_file.close()
+    if os.path.exists(name):
+        try:
+            stored = load_index(name, pub)
+        except Exception:
+            stored = None
+        if stored is not None and len(stored) <= len(lines):
+            digest = EMPTY_DIGEST
+            for line in lines[:len(stored)]:
+                digest = next_digest(digest, line)
+            if digest == stored.digest:
+                try:
+                    stored.extend(deserialize(line) for line in lines[len(stored):])
+                    return stored
+                except Exception:
+                    pass ## other cipher kind, rebuild
+    ciphers = [deserialize(line) for line in lines]
+    index = PrefixIndex(pub, len(ciphers) > 0 and isinstance(ciphers[0], CipherLevel1))
+    index.extend(ciphers)
+    index.save(name)
+    return index
+
+
+if __name__ == "__main__":
+    import time
+    import shutil
+    import tempfile
+    from aggregation import write_file
+
+    print "\n****testing prefix sum index:****"
+
+    priv, pub = generateKeys(256, save=False)
+    pub.enableShortExponent(80)
+    values = [random.randrange(0, 1000) for _ in xrange(2000)]
+    ciphers = [encrypt(pub, v) for v in values]
+
+    index = PrefixIndex(pub)
+    index.extend(ciphers)
+    start = time.time()
+    c = ciphers[100]
+    for x in ciphers[101:1900]:
+        c = e_add(pub, c, x)
+    chain_time = time.time() - start
+    start = time.time()
+    r = index.range_sum(100, 1900)
+    index_time = time.time() - start
+    print "range of 1800 ciphers, chained additions (ms): ", chain_time * 1000, " index (ms): ", index_time * 1000
+    assert r == c and decrypt(priv, pub, r) == sum(values[100:1900])
+    for _ in xrange(20):
+        i = random.randrange(0, len(values))
+        j = random.randrange(i, len(values) + 1)
+        assert decrypt(priv, pub, index.range_sum(i, j)) == sum(values[i:j])
+    assert decrypt(priv, pub, index.range_sum(5, 5)) == 0
+
+    level1 = []
+    for v in values[:200]:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, v)
+        level1.append(c)
+    index1 = PrefixIndex(pub, level1=True)
+    index1.extend(level1)
+    assert index1.range_sum(10, 150).get_value(priv, pub) == sum(values[10:150])
+    try:
+        index1.extend(level1[:3] + [ciphers[0]])
+        assert False
+    except Exception as e:
+        print "cipher kind is checked: ", e
+    assert len(index1) == 200 ## nothing was added
+
+    path = tempfile.mkdtemp()
+    data = os.path.join(path, "column.txt")
+    write_file(data, level1[:100])
+    stored = build_index(data, pub)
+    assert os.path.exists(index_file(data))
+    stored.append(level1[100]) ## incremental append to the saved index
+    out = open(data, "a")
+    out.write(serialize(level1[100]) + "\n")
+    out.close()
+    loaded = load_index(index_file(data), pub)
+    assert len(loaded) == 101
+    assert loaded.range_sum(50, 101).get_value(priv, pub) == sum(values[50:101])
+    write_file(data, level1[:120])
+    adds = []
+    add = PrefixIndex._add
+    PrefixIndex._add = lambda self, s, c: adds.append(1) or add(self, s, c)
+    stored = build_index(data, pub)
+    PrefixIndex._add = add
+    assert len(stored) == 120 and len(adds) == 19 ## only the new ciphers in the column are added
+    assert load_index(index_file(data), pub).total().get_value(priv, pub) == sum(values[:120])
+    try:
+        stored.extend([level1[0], ciphers[0]])
+        assert False
+    except Exception:
+        pass
+    assert len(load_index(index_file(data), pub)) == len(stored) == 120 ## file and memory stay in sync
+    write_file(data, level1[:10])
+    build_index(data, pub)
+    write_file(data, level1[120:130]) ## column rewritten with other ciphers
+    assert build_index(data, pub).range_sum(0, 10).get_value(priv, pub) == sum(values[120:130])
+    other_priv, other_pub = generateKeys(256, save=False)
+    try:
+        load_index(index_file(data), other_pub)
+        assert False
+    except Exception as e:
+        print "key is checked: ", e
+    shutil.rmtree(path)
@@ -155,31 +155,23 @@ def ts_add2 (c1,c2, pub):
     
 
     
-print "****testing two server boosted paillier:****"    
+if __name__ == "__main__":
+    print "****testing two server boosted paillier:****"
 
-priv, pub = generateKeys(256)
-m1 = 11
-m2 = 5 
-    
-c1 = CipherTwoServer(-1,-1)
-c2 = CipherTwoServer(-1,-1)
+    priv, pub = generateKeys(256)
+    m1 = 11
+    m2 = 5
 
-c1.create_level1_cipher(m1, pub)
-c2.create_level1_cipher(m2, pub)
+    c1 = CipherTwoServer(-1,-1)
+    c2 = CipherTwoServer(-1,-1)
 
-add_c = ts_add1(c1, c2, pub)
-print "two level 1 ciphers sum: ", m1, " + ", m2, " = ", add_c.get_value(priv, pub)
-mult_c = ts_mult(c1, c2, pub)
-print "two level 1 ciphers multiplication: ", m1, " * ", m2, " = ", mult_c.get_value(priv, pub)
-add2_c = ts_add2(mult_c, mult_c, pub)
-val = mult_c.get_value(priv, pub)
-print "two level 2 ciphers sum: ", val, " + ", val, " = ", add2_c.get_value(priv,pub)
+    c1.create_level1_cipher(m1, pub)
+    c2.create_level1_cipher(m2, pub)
 
-    
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+    add_c = ts_add1(c1, c2, pub)
+    print "two level 1 ciphers sum: ", m1, " + ", m2, " = ", add_c.get_value(priv, pub)
+    mult_c = ts_mult(c1, c2, pub)
+    print "two level 1 ciphers multiplication: ", m1, " * ", m2, " = ", mult_c.get_value(priv, pub)
+    add2_c = ts_add2(mult_c, mult_c, pub)
+    val = mult_c.get_value(priv, pub)
+    print "two level 2 ciphers sum: ", val, " + ", val, " = ", add2_c.get_value(priv,pub)
@@ -92,20 +92,9 @@ def server1_mult1(c1, c2, pub):
     :param c1: level 1 cipher
     :param c2: level 1 cipher
     :param pub: public key object
-    :return: level 2 cipher, where b part is another level 2 cipher
-    """
-    aux_a = mult1 (c1, c2, pub)
-    ## need to calculate multiplication of B parts, 
-    # however since both are encrypted I think we need 
-    #to convert them to level 1 ciphers and them multiply
-    #paper does not elaborate on that
-    b1 = CipherLevel1(1,1)
-    b2 = CipherLevel1(1,1)
-    b1.prepare_message(pub, c1.b)
-    b2.prepare_message(pub, c2.b)
-    aux_b = mult1(b1, b2, pub)
-    c = CipherLevel2(aux_a.a, aux_b)
-    return c
+    :return: encryption of m1*m2 - b1*b2
+    """
+    return mult1(c1, c2, pub).a
  
 def server2_mult1(b1, b2, pub):
     """
@@ -116,18 +105,32 @@ def server2_mult1(b1, b2, pub):
     :return: another b
     """
     return (b1 * b2) % pub.n
+
+def server2_encrypt(b, pub):
+    """
+    Computation on server 2: encrypts the b component of a level 2 cipher, so that
+    server 1 can use it in degree 3 terms without going back to the key holder.
+    It only depends on the values server 2 already holds, so it can be done in a
+    preprocessing phase.
+    :param b: b component of a level 2 cipher
+    :param pub: public key object
+    :return: encryption of b
+    """
+    return encrypt(pub, b)
     
-def ts_mult1(c1, c2, priv, pub):
+def ts_mult1(c1, c2, pub):
     """
-    Computes the multiplication of 2 level 1 cipher
+    Computes the multiplication of 2 level 1 cipher.
+    The alpha of the result is a level 2 cipher whose a is enc(m1*m2 - b1*b2)
+    and whose b is enc(b1*b2)
     :param c1: Cipher third degree
     :param c2: Cipher third degree
     :param pub: public key object
     :return: Cipher third degree with level 2 cipher
     """
-    aux = server1_mult1(c1.alpha, c2.alpha, pub)
-    alpha = CipherLevel2(aux.a, aux.b.get_value(priv, pub))
+    a = server1_mult1(c1.alpha, c2.alpha, pub)
     beta = server2_mult1(c1.beta, c2.beta, pub)
+    alpha = CipherLevel2(a, server2_encrypt(beta, pub))
     c = CipherThirdDegree(alpha, beta)
     return c
     
@@ -159,43 +162,40 @@ def ts_add2(c1, c2, pub):
     
 def server1_mult2(c1, c2, pub):
     """
-    Computations on server on for level 1 * level 2 ciphers
+    Computations on server 1 for level 1 * level 2 ciphers.
+    With m1 = a1 + b1 and the level 2 cipher holding enc(M - B) and enc(B),
+    server 1 computes enc(a1 * M)
     :param c1: level 1 cipher
     :param c2: level 2 cipher
     :param pub: public key object
-    :return: two parts to construct level 3 cipher
+    :return: encryption of a1 * M
     """
-    #aux = cmult2(c1.alpha, c2, pub)
-    aux = e_mul_const(pub, c2.a, c1.a)
-    aux2 = e_mul_const(pub, c2.b, c1.a)
-    
-    ##same thing that happened on mult1
-    ##however here we cant send the private key to the server, it would not make any sense
-    ##so lets justs send both parts and the client adds them in a final computation
-    b1 = CipherLevel1(1,1)
-    b2 = CipherLevel1(1,1)
-    b1.prepare_message(pub, c1.b)
-    b2.prepare_message(pub, c2.b)
-    aux3 = mult1(b1, b2, pub)
-    #aux3 = mult1 (c1.b, c2.a, pub)
-    aux4 = e_add(pub, aux, aux2)
-    #delta = e_add(aux3, aux4, pub)
-    #return delta
-    return aux4, aux3
-    
+    return e_mul_const(pub, e_add(pub, c2.a, c2.b), c1.a)
+
+def server2_mult2(alpha, b1, b2, pub):
+    """
+    Computations on server 2 for level 1 * level 2 ciphers
+    :param alpha: a of the level 2 cipher, enc(M - B), sent by server 1
+    :param b1: b component of the level 1 cipher
+    :param b2: b component of the level 2 cipher
+    :param pub: public key object
+    :return: encryption of b1 * (M - B) and the b of the level 3 cipher
+    """
+    return e_mul_const(pub, alpha, b1), (b1 * b2) % pub.n
     
-def ts_mult2(c1, c2, priv, pub):
+def ts_mult2(c1, c2, pub):
     """
-    Calculates the multiplication of level 1 by level 2 cipher on two servers
+    Calculates the multiplication of level 1 by level 2 cipher on two servers.
+    m1 * M = a1 * M + b1 * (M - B) + b1 * B, the first term is computed by
+    server 1, the second by server 2 and the last one is the new b
     :param c1: Cipher third degree level 1
     :param c2: Cipher third degree level 2
     :param pub: public key object
     :return: Cipher third degree of level 3
     """
-    aux_a, aux_b = server1_mult2(c1.alpha, c2.alpha, pub)
-    alpha = e_add(pub, aux_a, aux_b.get_value(priv,pub))
-    #alpha = server1_mult2(c1.alpha, c2.alpha, pub)
-    beta = server2_mult1(c1.beta, c2.beta, pub) ##same as mult 1
+    aux_a = server1_mult2(c1.alpha, c2.alpha, pub)
+    aux_b, beta = server2_mult2(c2.alpha.a, c1.beta, c2.beta, pub)
+    alpha = e_add(pub, aux_a, aux_b)
     c = CipherThirdDegree(alpha, beta)
     return c
     
@@ -224,30 +224,35 @@ def ts_add3(c1, c2, pub):
     
     
     
-priv, pub = generateKeys(256)
-m1 = 11
-m2 = 5 
+if __name__ == "__main__":
+    priv, pub = generateKeys(256)
+    m1 = 11
+    m2 = 5
 
-c1 = CipherThirdDegree(-1, -1)
-c2 = CipherThirdDegree(-1, -1)
+    c1 = CipherThirdDegree(-1, -1)
+    c2 = CipherThirdDegree(-1, -1)
 
-c1.create_level1_cipher(m1, pub)
-c2.create_level1_cipher(m2, pub)
+    c1.create_level1_cipher(m1, pub)
+    c2.create_level1_cipher(m2, pub)
 
-print "*****Testing third degree implementation*****"
+    print "*****Testing third degree implementation*****"
 
-add1_c = ts_add1(c1, c2, pub)
-print "add 1 test: ", m1, " + ", m2, " = ", add1_c.get_value(priv,pub)
-mult1_c = ts_mult1(c1, c2, priv, pub)
-print "mult1 test: ", m1, " * ", m2, " = ", mult1_c.get_value(priv, pub)
-add2_c = ts_add2(mult1_c, mult1_c, pub)
-val = mult1_c.get_value(priv, pub)
-print "add2 test: ", val, " + ", val, " = ", add2_c.get_value(priv, pub)
-mult2_c = ts_mult2(c1, mult1_c, priv, pub)
-print "mult2 test: ", m1, " * ", val, " = ", mult2_c.get_value(priv, pub)
-add3_c = ts_add3(mult2_c, mult2_c, pub)
-val = mult2_c.get_value(priv, pub)
-print "add3 test: ", val, " + ", val, " = ", add3_c.get_value(priv, pub)
-    
-    
-    
+    add1_c = ts_add1(c1, c2, pub)
+    print "add 1 test: ", m1, " + ", m2, " = ", add1_c.get_value(priv,pub)
+    assert add1_c.get_value(priv, pub) == m1 + m2
+    mult1_c = ts_mult1(c1, c2, pub)
+    print "mult1 test: ", m1, " * ", m2, " = ", mult1_c.get_value(priv, pub)
+    assert mult1_c.get_value(priv, pub) == m1 * m2
+    add2_c = ts_add2(mult1_c, mult1_c, pub)
+    val = mult1_c.get_value(priv, pub)
+    print "add2 test: ", val, " + ", val, " = ", add2_c.get_value(priv, pub)
+    assert add2_c.get_value(priv, pub) == 2 * val
+    mult2_c = ts_mult2(c1, mult1_c, pub)
+    print "mult2 test: ", m1, " * ", val, " = ", mult2_c.get_value(priv, pub)
+    assert mult2_c.get_value(priv, pub) == m1 * val
+    mult2_c = ts_mult2(c2, add2_c, pub)
+    assert mult2_c.get_value(priv, pub) == m2 * 2 * val
+    add3_c = ts_add3(mult2_c, mult2_c, pub)
+    val = mult2_c.get_value(priv, pub)
+    print "add3 test: ", val, " + ", val, " = ", add3_c.get_value(priv, pub)
+    assert add3_c.get_value(priv, pub) == 2 * val
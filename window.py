@@ -0,0 +1,258 @@
+from collections import deque
+from paillier import *
+from boosted_paillier import *
+
+"""
+This code implements sliding window accumulators over a stream of ciphers: the sum of
+the last size ciphers is kept up to date in O(1) per event instead of adding the whole
+window again on every tick.
+The paillier part uses two stacks, so no modular inverse is needed: new ciphers go to
+the back stack with its running product, and when the oldest cipher has to be evicted
+and the front stack is empty, the back stack is moved to the front as suffix products.
+Each cipher is multiplied at most three times (push, move, read), so pushing and reading
+on every event costs O(1) amortized multiplications, and the result is the same
+ciphertext as adding the window again.
+For level 1 ciphers the a parts are added and subtracted in plain. For level 2 ciphers
+the a parts are handled like paillier ciphertexts and the pairs are kept in a list that
+is only appended to (and compacted once half of it was evicted), so the pairs of a
+result are an O(1) read only view (PairsView) that later pushes do not change, and it
+never has more than size times the pairs of one cipher.
+Usage: python window.py [--check-rate] (--check-rate fails if a window does not reach
+100000 events/sec)
+"""
+
+class WindowSum():
+    """
+    Sum of the last size paillier ciphertexts of a stream
+    """
+
+    def __init__(self, pub, size):
+        """
+        Constructs an empty window
+
+        :param pub: public key object
+        :param size: number of ciphers in the window
+        """
+        if size < 1:
+            raise Exception("window size must be positive")
+        self.pub = pub
+        self.size = size
+        self.front = [] ## suffix products, the last one includes the oldest cipher
+        self.back = [] ## ciphers pushed after the last move
+        self.back_sum = 1 ## product of the back stack
+
+    def __len__(self):
+        return len(self.front) + len(self.back)
+
+    def push(self, c):
+        """
+        Adds a cipher to the window and evicts the oldest one if it is full
+
+        :param c: paillier ciphertext
+        :return: returns nothing
+        """
+        n_sq = self.pub.n_sq
+        self.back.append(c)
+        self.back_sum = self.back_sum * c % n_sq
+        if len(self.front) + len(self.back) > self.size:
+            if not self.front:
+                total = 1
+                for x in reversed(self.back):
+                    total = total * x % n_sq
+                    self.front.append(total)
+                self.back = []
+                self.back_sum = 1
+            self.front.pop()
+
+    def value(self):
+        """
+        :return: paillier ciphertext of the sum of the window
+        """
+        if self.front:
+            return self.front[-1] * self.back_sum % self.pub.n_sq
+        return self.back_sum
+
+class WindowSum1():
+    """
+    Sum of the last size level 1 ciphers of a stream
+    """
+
+    def __init__(self, pub, size):
+        """
+        Constructs an empty window
+
+        :param pub: public key object
+        :param size: number of ciphers in the window
+        """
+        self.b = WindowSum(pub, size)
+        self.items = deque()
+        self.a = 0
+
+    def __len__(self):
+        return len(self.b)
+
+    def push(self, c):
+        """
+        Adds a level 1 cipher to the window and evicts the oldest one if it is full
+
+        :param c: level 1 cipher
+        :return: returns nothing
+        """
+        n = self.b.pub.n
+        self.b.push(c.b)
+        self.items.append(c.a)
+        self.a = (self.a + c.a) % n
+        if len(self.items) > self.b.size:
+            self.a = (self.a - self.items.popleft()) % n
+
+    def value(self):
+        """
+        :return: level 1 cipher of the sum of the window
+        """
+        return CipherLevel1(self.a, self.b.value())
+
+class PairsView():
+    """
+    Read only view of the pairs [start, end) of a list that is only appended to
+    """
+
+    def __init__(self, pairs, start, end):
+        self._pairs = pairs
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __iter__(self):
+        for i in xrange(self._start, self._end):
+            yield self._pairs[i]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("pair index out of range")
+        return self._pairs[self._start + i]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+class WindowSum2():
+    """
+    Sum of the last size level 2 ciphers of a stream
+    """
+
+    def __init__(self, pub, size):
+        """
+        Constructs an empty window
+
+        :param pub: public key object
+        :param size: number of ciphers in the window
+        """
+        self.a = WindowSum(pub, size)
+        self.pairs = [] ## only appended to, the window is pairs[start:]
+        self.start = 0
+        self.counts = deque()
+
+    def __len__(self):
+        return len(self.a)
+
+    def push(self, c):
+        """
+        Adds a level 2 cipher to the window and evicts the oldest one if it is full
+
+        :param c: level 2 cipher
+        :return: returns nothing
+        """
+        self.a.push(c.a)
+        self.pairs.extend(c.b)
+        self.counts.append(len(c.b))
+        if len(self.counts) > self.a.size:
+            self.start += self.counts.popleft()
+            if self.start > len(self.pairs) // 2:
+                self.pairs = self.pairs[self.start:] ## a new list, older views keep the old one
+                self.start = 0
+
+    def value(self):
+        """
+        Returns the sum of the window in O(1): the b of the result is a PairsView
+        of the pairs in the window, which is not changed by later pushes
+
+        :return: level 2 cipher of the sum of the window
+        """
+        return CipherLevel2(self.a.value(), PairsView(self.pairs, self.start, len(self.pairs)))
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    print "\n****testing sliding windows:****"
+
+    priv, pub = generateKeys(256, save=False)
+    pub.enableShortExponent(80)
+    size = 50
+    values = [random.randrange(0, 1000) for _ in xrange(300)]
+    ciphers = [encrypt(pub, v) for v in values]
+    level1 = []
+    for v in values:
+        c = CipherLevel1(-1, -1)
+        c.prepare_message(pub, v)
+        level1.append(c)
+    squares = [mult1(c, c, pub) for c in level1]
+
+    sums = WindowSum(pub, size)
+    sums1 = WindowSum1(pub, size)
+    sums2 = WindowSum2(pub, size)
+    for i in xrange(len(values)):
+        sums.push(ciphers[i])
+        sums1.push(level1[i])
+        sums2.push(squares[i])
+        if i % 37 == 0 or i == len(values) - 1:
+            window = values[max(0, i + 1 - size):i + 1]
+            assert decrypt(priv, pub, sums.value()) == sum(window)
+            assert sums1.value().get_value(priv, pub) == sum(window)
+            assert sums2.value().get_value(priv, pub) == sum(v * v for v in window)
+    assert len(sums2.value().b) == size ## pair list stays bounded
+    snapshot = sums2.value()
+    before = snapshot.get_value(priv, pub)
+    for c in squares[:size]:
+        sums2.push(c)
+    assert snapshot.get_value(priv, pub) == before ## earlier results do not change
+    assert add2(snapshot, sums2.value(), pub).get_value(priv, pub) == \
+        (before + sum(v * v for v in values[:size])) % pub.n
+    assert len(sums2.pairs) <= 2 * size + 1
+
+    expected = ciphers[-size]
+    for c in ciphers[-size + 1:]:
+        expected = e_add(pub, expected, c)
+    assert sums.value() == expected ## same ciphertext as adding the window again
+
+    events = 100000
+    target = 100000
+    check_rate = "--check-rate" in sys.argv
+    for name, window, stream in [("paillier", WindowSum(pub, 1000), ciphers),
+                                 ("level 1", WindowSum1(pub, 1000), level1),
+                                 ("level 2", WindowSum2(pub, 1000), squares)]:
+        stream = [stream[i % len(stream)] for i in xrange(events)]
+        start = time.time()
+        for c in stream:
+            window.push(c)
+            window.value() ## read on every event
+        rate = int(events / (time.time() - start))
+        print name, "window, push and read on every event: ", rate, " events/sec (target ", target, ")"
+        if check_rate:
+            assert rate >= target
+    assert window.value().get_value(priv, pub) == sum(values[i % len(values)] ** 2 for i in xrange(events - 1000, events))
+    assert len(window.value().b) == 1000
+
+    start = time.time()
+    for i in xrange(100):
+        total = stream[0]
+        for c in stream[1:1000]:
+            total = add2(total, c, pub)
+    print "adding a level 2 window of 1000 again on every event: ", int(100 / (time.time() - start)), " events/sec"